@@ -0,0 +1,290 @@
+#!/usr/local/bin/python2.7
+# encoding: utf-8
+'''
+mock_wiki -- local stand-in for pathofexile.gamepedia.com
+
+Serves the fixture pages in benchmarks/fixtures for every list and item
+page, as an HTTP proxy, with injected latency, throttling and errors.
+Meant for watching the AdaptiveConcurrencyMiddleware at work without
+hitting the real wiki::
+
+    python benchmarks/mock_wiki.py --latency 0.2 --load-latency 0.05 --throttle-above 6
+    http_proxy=http://127.0.0.1:8800 python poe_scrape.py -o /tmp/mock_out
+
+The server prints what it saw when stopped with Ctrl-C (or SIGTERM), the crawl's
+adaptive_concurrency/* stats show how the crawler reacted.
+
+api.php answers recent changes queries from the canned feed in 
+fixtures/recentchanges.json (see poe_scrape.py --changes), honouring 
+rcstart, rcdir, rclimit and rccontinue. Page content queries of the 
+gamepedia_api spider are answered like the recorded responses in 
+fixtures/api_query_*.json: titles are normalized, redirected and 
+reported missing as recorded there, and at most --parse-limit pages 
+are parsed per request, the rest follow through continue::
+
+    http_proxy=http://127.0.0.1:8800 python poe_scrape.py -s all -o /tmp/mock_out
+
+:author:    | André Berg
+:copyright: | 2015 Iris VFX. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre@irisvfx.com
+'''
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import threading
+
+from email.utils import formatdate
+from argparse import ArgumentParser
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+LIST_FIXTURE = "List_of_unique_belts.html"
+ITEM_FIXTURE = "special_item.html"
+RECENT_CHANGES_FIXTURE = "recentchanges.json"
+API_LIST_FIXTURE = "api_query_lists.json"
+API_ITEM_FIXTURE = "api_query_items.json"
+
+
+def _read_json(filename):
+    with open(os.path.join(FIXTURE_DIR, filename), 'rb') as f:
+        return json.load(f)
+
+
+def _get_parsed_content(response):
+    '''Parsed content of the first page in a recorded query response that has one.'''
+    for page in response['query']['pages'].itervalues():
+        if 'revisions' in page:
+            return page['revisions'][0]['*']
+    raise ValueError("No parsed page in recorded response")
+
+
+def normalize_title(title):
+    '''List_of_unique_belts -> List of unique belts, as the wiki does for requested titles.'''
+    title = title.replace("_", " ").strip()
+    return title[:1].upper() + title[1:]
+
+
+class MockWiki(object):
+    '''Page contents, failure injection and request counters, shared by all handler threads.'''
+
+    def __init__(self, options):
+        super(MockWiki, self).__init__()
+        self.options = options
+        with open(os.path.join(FIXTURE_DIR, LIST_FIXTURE), 'rb') as f:
+            self.list_page = f.read()
+        with open(os.path.join(FIXTURE_DIR, ITEM_FIXTURE), 'rb') as f:
+            self.item_page = f.read()
+        self.recent_changes = _read_json(RECENT_CHANGES_FIXTURE)
+        list_query, item_query = _read_json(API_LIST_FIXTURE), _read_json(API_ITEM_FIXTURE)
+        self.list_content = _get_parsed_content(list_query)
+        self.item_content = _get_parsed_content(item_query)
+        self.redirects = dict((redirect['from'], redirect['to'])
+                              for query in (list_query, item_query)
+                              for redirect in query['query'].get('redirects', ()))
+        self.missing = set(page['title'] for query in (list_query, item_query)
+                           for page in query['query']['pages'].itervalues() if 'missing' in page)
+        robots = ["User-agent: *", "Disallow: /Special:"]
+        if options.crawl_delay:
+            robots.append("Crawl-delay: {0}".format(options.crawl_delay))
+        self.robots_txt = "\n".join(robots) + "\n"
+        # pages never change, the HTTP cache can revalidate them
+        self.last_modified = formatdate(time.time(), usegmt=True)
+        self.lock = threading.Lock()
+        self.random = random.Random(options.seed)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.counts = {}
+        self.pages = {}
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return self.in_flight, self.random.random(), self.random.random()
+
+    def leave(self, status, kind):
+        with self.lock:
+            self.in_flight -= 1
+            self.counts[status] = self.counts.get(status, 0) + 1
+            self.pages[kind] = self.pages.get(kind, 0) + 1
+
+    def respond(self, path, query, headers):
+        '''Return (status, headers, body) for path after the injected delay.'''
+        options = self.options
+        in_flight, jitter, chance = self.enter()
+        status = 200
+        kind = 'list' if path.startswith('/List_of_unique_') else 'item'
+        try:
+            time.sleep(options.latency + options.load_latency * (in_flight - 1) + options.jitter * jitter)
+            if path == '/robots.txt':
+                kind = 'robots'
+                return status, {'Content-Type': 'text/plain'}, self.robots_txt
+            if path == '/api.php':
+                kind = 'api'
+                params = parse_qs(query)
+                if params.get('list') == ['recentchanges']:
+                    body = self.query_recent_changes(params)
+                else:
+                    body = self.query_pages(params)
+                return status, {'Content-Type': 'application/json'}, body
+            if options.throttle_above and in_flight > options.throttle_above:
+                status = 429
+                return status, {'Retry-After': str(options.retry_after)}, "Too many requests\n"
+            if chance < options.error_rate:
+                status = 503
+                return status, {}, "Service unavailable\n"
+            if headers.get('If-Modified-Since') == self.last_modified:
+                status = 304
+                return status, {'Last-Modified': self.last_modified}, ""
+            page = self.list_page if kind == 'list' else self.item_page
+            return status, {'Content-Type': 'text/html; charset=utf-8', 'Last-Modified': self.last_modified}, page
+        finally:
+            self.leave(status, kind)
+
+    def query_recent_changes(self, params):
+        '''JSON of a list=recentchanges query, see https://www.mediawiki.org/wiki/API:RecentChanges'''
+        get = lambda name, default=None: params.get(name, [default])[0]
+        newer = get('rcdir', 'older') == 'newer'
+        key = lambda change: (change['timestamp'], change['rcid'])
+        changes = sorted(self.recent_changes, key=key, reverse=not newer)
+        namespaces = get('rcnamespace')
+        if namespaces is not None:
+            namespaces = set(int(ns) for ns in namespaces.split('|'))
+            changes = [change for change in changes if change['ns'] in namespaces]
+        start = get('rcstart')
+        if start is not None:
+            changes = [change for change in changes 
+                       if (change['timestamp'] >= start if newer else change['timestamp'] <= start)]
+        position = get('rccontinue')
+        if position is not None:
+            timestamp, rcid = position.split('|')
+            position = (timestamp, int(rcid))
+            changes = [change for change in changes 
+                       if (key(change) >= position if newer else key(change) <= position)]
+        limit = int(get('rclimit', 10))
+        data = {'batchcomplete': '', 'query': {'recentchanges': changes[:limit]}}
+        if len(changes) > limit:
+            following = changes[limit]
+            data['continue'] = {'rccontinue': "{0}|{1}".format(following['timestamp'], following['rcid']),
+                                'continue': '-||'}
+        return json.dumps(data)
+
+    def query_pages(self, params):
+        '''JSON of a prop=revisions&rvparse query, see https://www.mediawiki.org/wiki/API:Revisions'''
+        get = lambda name, default=None: params.get(name, [default])[0]
+        query = {'pages': {}}
+        titles = []
+        for title in get('titles', "").decode('utf-8').split(u"|"):
+            name = normalize_title(title)
+            if name != title:
+                query.setdefault('normalized', []).append({'from': title, 'to': name})
+            if name in self.redirects:
+                query.setdefault('redirects', []).append({'from': name, 'to': self.redirects[name]})
+                name = self.redirects[name]
+            if name not in titles:
+                titles.append(name)
+        start = int(get('rvcontinue', 0))
+        end = start + self.options.parse_limit
+        for index, title in enumerate(sorted(titles)):
+            if title in self.missing:
+                query['pages'][str(-1 - index)] = {'ns': 0, 'title': title, 'missing': ""}
+                continue
+            page = {'pageid': 3000 + index, 'ns': 0, 'title': title}
+            if start <= index < end:
+                content = self.list_content if title.startswith(u"List of unique ") else self.item_content
+                page['revisions'] = [{'contentformat': 'text/x-wiki', 'contentmodel': 'wikitext', '*': content}]
+            query['pages'][str(page['pageid'])] = page
+        data = {'query': query}
+        if end < len(titles):
+            data['continue'] = {'rvcontinue': str(end), 'continue': '||'}
+        else:
+            data['batchcomplete'] = ""
+        return json.dumps(data)
+
+    def summary(self):
+        counts = ", ".join("{0}: {1}".format(status, count) for status, count in sorted(self.counts.iteritems()))
+        pages = ", ".join("{0}: {1}".format(kind, count) for kind, count in sorted(self.pages.iteritems()))
+        return "{0} requests ({1}; {2}), at most {3} in flight".format(sum(self.counts.itervalues()),
+                                                                     counts, pages, self.max_in_flight)
+
+
+class MockWikiHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        status, headers, body = self.server.wiki.respond(url.path, url.query, self.headers)
+        self.send_response(status)
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockWikiServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(options):
+    '''MockWikiServer for options (see parse_args), port 0 picks a free port.'''
+    server = MockWikiServer(('127.0.0.1', options.port), MockWikiHandler)
+    server.wiki = MockWiki(options)
+    return server
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Serve the benchmark fixtures as pathofexile.gamepedia.com, "
+                                        "with injected latency and failures. Use it as http_proxy.")
+    parser.add_argument("-p", "--port", dest="port", type=int, help="port to listen on [default: %(default)s]", metavar="N")
+    parser.add_argument("--latency", dest="latency", type=float, help="seconds each response takes [default: %(default)s]", metavar="S")
+    parser.add_argument("--load-latency", dest="load_latency", type=float, help="extra seconds per other request in flight, a server slowing down under load [default: %(default)s]", metavar="S")
+    parser.add_argument("--jitter", dest="jitter", type=float, help="up to this many random extra seconds [default: %(default)s]", metavar="S")
+    parser.add_argument("--throttle-above", dest="throttle_above", type=int, help="answer 429 while more than N requests are in flight (0 never does) [default: %(default)s]", metavar="N")
+    parser.add_argument("--retry-after", dest="retry_after", type=int, help="Retry-After seconds of the 429s [default: %(default)s]", metavar="S")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, help="fraction of pages answered with 503 [default: %(default)s]", metavar="P")
+    parser.add_argument("--crawl-delay", dest="crawl_delay", type=float, help="Crawl-delay in robots.txt (0 for none) [default: %(default)s]", metavar="S")
+    parser.add_argument("--parse-limit", dest="parse_limit", type=int, help="pages api.php parses per request, the rest follow through continue [default: %(default)s]", metavar="N")
+    parser.add_argument("--seed", dest="seed", type=int, help="random seed for jitter and errors [default: %(default)s]", metavar="N")
+    parser.set_defaults(port=8800, latency=0.1, load_latency=0.0, jitter=0.0, throttle_above=0,
+                        retry_after=1, error_rate=0.0, crawl_delay=0, parse_limit=5, seed=1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    server = make_server(options)
+    print("Mock wiki on http://127.0.0.1:{0}, Ctrl-C to stop".format(options.port), file=sys.stderr)
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(server.wiki.summary(), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
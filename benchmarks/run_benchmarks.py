@@ -0,0 +1,662 @@
+#!/usr/local/bin/python2.7
+# encoding: utf-8
+'''
+run_benchmarks -- micro-benchmarks for poe_scrape
+
+Times spider parsing, the mod transforms and output assembly on the
+fixture pages in benchmarks/fixtures, scaled up to synthetic item sets,
+plus poe_scrape.py startup and a crawl of both spiders against
+mock_wiki.py, and writes the results as JSON so runs can be compared.
+The crawl fails if the two spiders' Uniques.txt differ.
+
+Usage::
+
+    python benchmarks/run_benchmarks.py -o before.json
+    python benchmarks/run_benchmarks.py -o after.json --compare before.json
+
+:author:    | André Berg
+:copyright: | 2015 Iris VFX. All rights reserved.
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+:contact:   | andre@irisvfx.com
+'''
+from __future__ import print_function
+
+import os
+import sys
+import json
+import itertools
+import time
+import shutil
+import platform
+import tempfile
+import threading
+import subprocess
+
+from argparse import ArgumentParser
+from timeit import default_timer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, "fixtures")
+POE_SCRAPE = os.path.join(os.path.dirname(BENCHMARK_DIR), "poe_scrape.py")
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from lxml import html
+from scrapy.http import HtmlResponse, TextResponse, Request
+from scrapy.selector import Selector
+
+from scrapy_engine.items import UniqueItem, is_special_item
+from scrapy_engine.pipelines import UniqueItemsProcessor, ValueTransform, TextTransform, SanitizeTransform
+from scrapy_engine.spiders.gamepedia import GamepediaSpider, get_list_path, get_category, _get_html_parser
+from scrapy_engine.spiders.gamepedia_api import GamepediaApiSpider
+
+import mock_wiki
+
+SITE = "http://pathofexile.gamepedia.com"
+LIST_FIXTURE = "List_of_unique_belts.html"
+SPECIAL_ITEM_FIXTURE = "special_item.html"
+# recorded api.php responses, with continue, normalized and redirected titles and a missing page
+API_FIXTURES = ["api_query_lists.json", "api_query_items.json"]
+# the list fixture is served as each of these, so output assembly sees several categories
+LIST_PATHS = ["List_of_unique_belts", "List_of_unique_boots", "List_of_unique_rings", "List_of_unique_amulets"]
+RESULTS_VERSION = 1
+
+
+def _read_fixture(filename):
+    with open(os.path.join(FIXTURE_DIR, filename), 'rb') as f:
+        return f.read()
+
+
+def _scale_list_page(body, scale):
+    '''Repeat the item rows of a list page scale times, with distinct names.'''
+    head, sep, rest = body.partition("<tr id=")
+    rows, tail_sep, tail = rest.rpartition("</tr>")
+    rows = sep + rows + tail_sep
+    copies = [rows]
+    for i in xrange(2, scale + 1):
+        copies.append(rows.replace('<tr id="', '<tr id="{0}_'.format(i))
+                          .replace(' title="', ' title="{0} '.format(i))
+                          .replace(' href="/', ' href="/{0}_'.format(i)))
+    return head + "\n".join(copies) + tail
+
+
+class Workload(object):
+    '''Responses and items of one scale, built once and shared by all benchmarks.'''
+
+    def __init__(self, scale):
+        super(Workload, self).__init__()
+        self.scale = scale
+        body = _scale_list_page(_read_fixture(LIST_FIXTURE), scale)
+        self.list_responses = [HtmlResponse("{0}/{1}".format(SITE, list_path), body=body, encoding="utf-8")
+                               for list_path in LIST_PATHS]
+        spider = GamepediaSpider()
+        self.items = [item for response in self.list_responses
+                      for item in spider.parse(response) if not isinstance(item, Request)]
+        self.special_items = [item for item in self.items if is_special_item(item)]
+        special_body = _read_fixture(SPECIAL_ITEM_FIXTURE)
+        self.special_responses = [HtmlResponse(item['url'], body=special_body, encoding="utf-8",
+                                               request=Request(item['url'], meta={'unique_items': [item]}))
+                                  for item in self.special_items]
+        self.details = [details for response in self.special_responses
+                        for details in spider.parse_special_item(response)]
+        self.mods = [(mod, item['category']) for item in self.items
+                     for mod in item['implicit_mods'] + item['affix_mods']]
+
+    def make_processor(self, outdir=None):
+        processor = UniqueItemsProcessor()
+        processor.spider = GamepediaSpider()
+        processor.append_item_url = True
+        processor.set_transform_cache(4096)
+        if outdir is not None:
+            processor.set_outdir(outdir)
+        for item in self.items:
+            record = processor.add_unique_item(item)
+            if processor.is_special_item(item):
+                processor.add_special_item(record)
+        for details in self.details:
+            processor.add_special_item_details(details)
+        return processor
+
+
+class Benchmark(object):
+    '''
+    Base class for benchmarks. setup is run before each timed call
+    to run and not included in the timings. units is the number of
+    pages, mods, items, ... a single run processes.
+    '''
+
+    name = None
+    # False for benchmarks that don't depend on the workload, they run for the first scale only
+    scaled = True
+
+    def __init__(self, workload):
+        super(Benchmark, self).__init__()
+        self.workload = workload
+        self.units = 0
+
+    def setup(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+
+class ParseBenchmark(Benchmark):
+
+    name = "GamepediaSpider.parse"
+
+    def __init__(self, workload):
+        super(ParseBenchmark, self).__init__(workload)
+        self.spider = GamepediaSpider()
+        self.units = len(workload.items)
+
+    def run(self):
+        parse = self.spider.parse
+        for response in self.workload.list_responses:
+            for _ in parse(response):
+                pass
+
+
+def _selector_unique_items(response):
+    '''The list rows of response as GamepediaSpider.parse extracted them with Selectors before 0d00b66.'''
+    list_path = get_list_path(response.url)
+    category = get_category(list_path)
+    url_prefix = response.url[:-len(list_path) - 1]
+    for an_item in Selector(response).xpath(".//tr[@id]"):
+        unique_item = UniqueItem()
+        unique_item['name'] = an_item.xpath("./td[1]/a[1]/@title").extract()[0]
+        num_spans = len(an_item.xpath("./td[last()]//div[@class='itemboxstatsgroup']/span"))
+        if num_spans == 1:
+            unique_item['implicit_mods'] = []
+        else:
+            unique_item['implicit_mods'] = an_item.xpath("./td[last()]//div[@class='itemboxstatsgroup'][1]//span/text()").extract()
+        unique_item['affix_mods'] = an_item.xpath("./td[last()]//div[@class='itemboxstatsgroup'][last()]//span/text()").extract()
+        unique_item['url'] = "{}{}".format(url_prefix, an_item.xpath("./td[1]/a[1]/@href").extract()[0])
+        unique_item['category'] = category
+        unique_item['list_path'] = list_path
+        yield unique_item
+
+
+def _xpath_unique_items(response, spider):
+    '''The list rows of response as GamepediaSpider.parse extracts them now.'''
+    list_path = get_list_path(response.url)
+    doc = html.fromstring(response.body, base_url=response.url,
+                          parser=_get_html_parser(response.encoding))
+    return spider.extract_unique_items(doc, list_path, response.url[:-len(list_path) - 1])
+
+
+class SelectorRowsBenchmark(Benchmark):
+    '''List row extraction with Selectors, the way parse did it before the precompiled XPaths.'''
+
+    name = "list rows: Selector (before)"
+
+    def __init__(self, workload):
+        super(SelectorRowsBenchmark, self).__init__(workload)
+        self.units = sum(1 for response in workload.list_responses for _ in _selector_unique_items(response))
+        spider = GamepediaSpider()
+        for response in workload.list_responses:
+            before = [dict(item) for item in _selector_unique_items(response)]
+            after = [dict(item) for item in _xpath_unique_items(response, spider)]
+            if before != after:
+                raise RuntimeError("Selector and XPath rows of {0} differ".format(response.url))
+
+    def run(self):
+        for response in self.workload.list_responses:
+            for _ in _selector_unique_items(response):
+                pass
+
+
+class XPathRowsBenchmark(Benchmark):
+    '''List row extraction with the precompiled lxml XPaths of GamepediaSpider.extract_unique_items.'''
+
+    name = "list rows: precompiled XPaths"
+
+    def __init__(self, workload):
+        super(XPathRowsBenchmark, self).__init__(workload)
+        self.spider = GamepediaSpider()
+        self.units = sum(1 for response in workload.list_responses
+                         for _ in _xpath_unique_items(response, self.spider))
+
+    def run(self):
+        for response in self.workload.list_responses:
+            for _ in _xpath_unique_items(response, self.spider):
+                pass
+
+
+class ParseSpecialItemBenchmark(Benchmark):
+
+    name = "GamepediaSpider.parse_special_item"
+
+    def __init__(self, workload):
+        super(ParseSpecialItemBenchmark, self).__init__(workload)
+        self.spider = GamepediaSpider()
+        self.units = len(workload.special_responses)
+
+    def run(self):
+        parse_special_item = self.spider.parse_special_item
+        for response in self.workload.special_responses:
+            parse_special_item(response)
+
+
+class ApiParseBenchmark(Benchmark):
+    '''GamepediaApiSpider.parse_api_response on the recorded api.php responses.'''
+
+    name = "GamepediaApiSpider.parse_api_response"
+    scaled = False
+
+    def __init__(self, workload):
+        super(ApiParseBenchmark, self).__init__(workload)
+        self.spider = GamepediaApiSpider()
+        self.responses = []
+        for filename in API_FIXTURES:
+            body = _read_fixture(filename)
+            query = json.loads(body)['query']
+            # the titles as requested, i.e. before the wiki normalized or redirected them
+            aliases = [entry for key in ('normalized', 'redirects') for entry in query.get(key, ())]
+            targets = set(entry['to'] for entry in aliases)
+            titles = ([entry['from'] for entry in aliases if entry['from'] not in targets] +
+                      [page['title'] for page in query['pages'].itervalues() if page['title'] not in targets])
+            request = Request("{0}/api.php".format(SITE), callback=self.spider.parse,
+                              meta={'pages': dict((title, title) for title in titles)})
+            self.responses.append(TextResponse(request.url, body=body, encoding="utf-8", request=request))
+        self.setup()
+        self.units = sum(len(self.spider.parse_api_response(response)[0]) for response in self.responses)
+
+    def setup(self):
+        for response in self.responses:
+            response.meta['done'] = set()
+
+    def run(self):
+        parse_api_response = self.spider.parse_api_response
+        for response in self.responses:
+            parse_api_response(response)
+
+
+class TransformBenchmark(Benchmark):
+    '''
+    Runs one DataTransform over all mods. Each transform gets the mods
+    the way the processor hands them over, i.e. already transformed
+    by the transforms before it.
+    '''
+
+    transform_cls = None
+
+    def __init__(self, workload):
+        super(TransformBenchmark, self).__init__(workload)
+        processor = workload.make_processor()
+        self.inputs = workload.mods
+        for transform in processor.transforms:
+            if isinstance(transform, self.transform_cls):
+                self.transform = transform
+                break
+            self.inputs = [(transform.transform(data.strip(), category), category)
+                           for data, category in self.inputs]
+        self.units = len(self.inputs)
+
+    def setup(self):
+        # rules_for caches per category, warm it up like the first few items of a crawl would
+        for data, category in self.inputs[:1]:
+            self.transform.transform(data, category)
+
+    def run(self):
+        transform = self.transform.transform
+        for data, category in self.inputs:
+            transform(data, category)
+
+
+class ValueTransformBenchmark(TransformBenchmark):
+    name = "ValueTransform.transform"
+    transform_cls = ValueTransform
+
+
+class TextTransformBenchmark(TransformBenchmark):
+    name = "TextTransform.transform"
+    transform_cls = TextTransform
+
+
+class SanitizeTransformBenchmark(TransformBenchmark):
+    name = "SanitizeTransform.transform"
+    transform_cls = SanitizeTransform
+
+
+class AddUniqueItemBenchmark(Benchmark):
+    '''Filling the item store of a fresh processor, as the pipeline does during a crawl.'''
+
+    name = "UniqueItemsProcessor.add_unique_item"
+
+    def __init__(self, workload):
+        super(AddUniqueItemBenchmark, self).__init__(workload)
+        self.units = len(workload.items)
+
+    def setup(self):
+        self.processor = UniqueItemsProcessor()
+
+    def run(self):
+        add_unique_item = self.processor.add_unique_item
+        for item in self.workload.items:
+            add_unique_item(item)
+
+
+class ApplyTransformBenchmark(Benchmark):
+    '''All transforms through the processor's transform cache, which starts out empty.'''
+
+    name = "UniqueItemsProcessor._apply_transform"
+
+    def __init__(self, workload):
+        super(ApplyTransformBenchmark, self).__init__(workload)
+        self.units = len(workload.mods)
+
+    def setup(self):
+        self.processor = self.workload.make_processor()
+
+    def run(self):
+        apply_transform = self.processor._apply_transform
+        for data, category in self.workload.mods:
+            apply_transform(data, category)
+
+
+class ProcessSpecialItemsBenchmark(Benchmark):
+
+    name = "UniqueItemsProcessor.process_special_items"
+
+    def __init__(self, workload):
+        super(ProcessSpecialItemsBenchmark, self).__init__(workload)
+        self.units = len(workload.special_items)
+
+    def setup(self):
+        self.processor = self.workload.make_processor()
+        for category in self.processor.categories:
+            self.processor._append_block(*self.processor._render_category(category))
+
+    def run(self):
+        self.processor.process_special_items()
+
+
+class ProcessAllBenchmark(Benchmark):
+    '''Rendering, special items, post-processing and writing Uniques.txt.'''
+
+    name = "UniqueItemsProcessor.process_all"
+
+    def __init__(self, workload):
+        super(ProcessAllBenchmark, self).__init__(workload)
+        self.units = len(workload.items)
+        self.outdir = None
+
+    def setup(self):
+        self.outdir = tempfile.mkdtemp(prefix="poe_scrape_bench")
+        self.processor = self.workload.make_processor(self.outdir)
+
+    def run(self):
+        self.processor.process_all()
+
+    def teardown(self):
+        shutil.rmtree(self.outdir, ignore_errors=True)
+
+
+class StartupBenchmark(Benchmark):
+    '''Wall time of a poe_scrape.py process with args, e.g. as run by cron wrappers and health checks.'''
+
+    scaled = False
+    args = None
+
+    def __init__(self, workload):
+        super(StartupBenchmark, self).__init__(workload)
+        self.units = 1
+
+    def run(self):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, POE_SCRAPE] + self.args, 
+                                  cwd=os.path.dirname(POE_SCRAPE), stdout=devnull, stderr=devnull)
+
+
+class MockWikiCrawlBenchmark(Benchmark):
+    '''
+    A complete crawl with both spiders against benchmarks/mock_wiki.py,
+    without the HTTP cache and the category store. Fails unless the
+    gamepedia_api spider writes the same Uniques.txt as the gamepedia one.
+    '''
+
+    name = "poe_scrape.py -s all (mock wiki)"
+    scaled = False
+    spiders = ("gamepedia", "gamepedia_api")
+
+    def __init__(self, workload):
+        super(MockWikiCrawlBenchmark, self).__init__(workload)
+        self.units = len(self.spiders)
+        self.server = None
+        self.outdir = None
+
+    def setup(self):
+        self.outdir = tempfile.mkdtemp(prefix="poe_scrape_bench")
+        self.server = mock_wiki.make_server(mock_wiki.parse_args(["--port", "0", "--latency", "0"]))
+        thread = threading.Thread(target=self.server.serve_forever, name="MockWiki")
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        env = dict(os.environ, http_proxy="http://127.0.0.1:{0}".format(self.server.server_address[1]),
+                   SCRAPY_HTTPCACHE_ENABLED="0", SCRAPY_CATEGORY_STORE_FILE="")
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, POE_SCRAPE, "-s", ",".join(self.spiders), "-o", self.outdir],
+                                  cwd=os.path.dirname(POE_SCRAPE), env=env, stdout=devnull, stderr=devnull)
+        outputs = [os.path.join(self.outdir, spider, "Uniques.txt") for spider in self.spiders]
+        if not UniqueItemsProcessor._has_same_content(*outputs):
+            raise RuntimeError("{0} and {1} differ".format(*outputs))
+
+    def teardown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.outdir, ignore_errors=True)
+
+
+class VersionStartupBenchmark(StartupBenchmark):
+    name = "poe_scrape.py --version"
+    args = ["--version"]
+
+
+class ListSpidersStartupBenchmark(StartupBenchmark):
+    name = "poe_scrape.py --list-spiders"
+    args = ["--list-spiders"]
+
+
+BENCHMARKS = [
+    SelectorRowsBenchmark,
+    XPathRowsBenchmark,
+    ParseBenchmark,
+    ParseSpecialItemBenchmark,
+    ApiParseBenchmark,
+    ValueTransformBenchmark,
+    TextTransformBenchmark,
+    SanitizeTransformBenchmark,
+    AddUniqueItemBenchmark,
+    ApplyTransformBenchmark,
+    ProcessSpecialItemsBenchmark,
+    ProcessAllBenchmark,
+    MockWikiCrawlBenchmark,
+    VersionStartupBenchmark,
+    ListSpidersStartupBenchmark,
+]
+
+
+# UniqueItemsProcessor attributes holding the scraped items, see item_store_size
+ITEM_STORAGE = ('item_store', 'item_names', 'special_items')
+
+
+def _deep_getsizeof(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        children = itertools.chain.from_iterable(obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        children = obj
+    else:
+        children = [getattr(obj, slot) for slot in getattr(type(obj), '__slots__', ())
+                    if hasattr(obj, slot)]
+        if hasattr(obj, '__dict__'):
+            children.append(obj.__dict__)
+    return size + sum(_deep_getsizeof(child, seen) for child in children)
+
+
+def _double_item_store(items):
+    '''
+    The item storage of UniqueItemsProcessor before 11cf11d: each scrapy 
+    item in unique_items (and special_items) plus a dict copy of it in 
+    the list of its category.
+    '''
+    unique_items = []
+    item_store = {}
+    special_items = []
+    for item in items:
+        unique_items.append(item)
+        item_store.setdefault(item['category'], []).append({
+            "name": item["name"],
+            "url": item["url"],
+            "implicit_mods": item["implicit_mods"],
+            "affix_mods": item["affix_mods"],
+            "category": item["category"],
+            "list_path": item.get("list_path")
+        })
+        if is_special_item(item):
+            special_items.append(item)
+    return unique_items, item_store, special_items
+
+
+def item_store_size(workload):
+    '''
+    Bytes taken by the items in a processor filled with workload's items,
+    strings included, and by the same items in the double store before.
+    '''
+    processor = workload.make_processor()
+    seen = set()
+    return {
+        "scale": workload.scale,
+        "items": len(workload.items),
+        "bytes": sum(_deep_getsizeof(getattr(processor, name), seen) for name in ITEM_STORAGE),
+        "bytes_before": _deep_getsizeof(_double_item_store(workload.items), set()),
+    }
+
+
+def run_benchmark(benchmark, repeat):
+    timings = []
+    for _ in xrange(repeat):
+        benchmark.setup()
+        try:
+            start = default_timer()
+            benchmark.run()
+            timings.append(default_timer() - start)
+        finally:
+            benchmark.teardown()
+    ordered = sorted(timings)
+    return {
+        "name": benchmark.name,
+        "scale": benchmark.workload.scale,
+        "units": benchmark.units,
+        "best": ordered[0],
+        "median": ordered[len(ordered) // 2],
+        "mean": sum(timings) / len(timings),
+        "runs": timings,
+    }
+
+
+def _get_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR,
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    '''Print best timings against baseline, return the (name, scale) pairs slower than threshold.'''
+    baseline_best = dict(((result["name"], result["scale"]), result["best"]) for result in baseline["results"])
+    regressions = []
+    print("{0:<45} {1:>5} {2:>10} {3:>10} {4:>7}".format("benchmark", "scale", "best", "baseline", "ratio"))
+    for result in results["results"]:
+        key = (result["name"], result["scale"])
+        before = baseline_best.get(key)
+        if not before:
+            print("{0:<45} {1:>5} {2:>10.4f} {3:>10} {4:>7}".format(key[0], key[1], result["best"], "-", "-"))
+            continue
+        ratio = result["best"] / before
+        flag = ""
+        if ratio > threshold:
+            regressions.append(key)
+            flag = " <-- slower"
+        print("{0:<45} {1:>5} {2:>10.4f} {3:>10.4f} {4:>7.2f}{5}"
+              .format(key[0], key[1], result["best"], before, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = ArgumentParser(description="Micro-benchmarks for poe_scrape, results are written as JSON.")
+    parser.add_argument("-s", "--scales", dest="scales", help="comma separated item set scales [default: %(default)s]", metavar="N,N,...")
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, help="timed runs per benchmark [default: %(default)s]", metavar="N")
+    parser.add_argument("-k", "--filter", dest="filter", help="only run benchmarks whose name contains this text", metavar="TEXT")
+    parser.add_argument("-o", "--output", dest="output", help="write results to this file instead of stdout", metavar="path")
+    parser.add_argument("-c", "--compare", dest="compare", help="compare with the results in this file, exit with 1 on regressions", metavar="path")
+    parser.add_argument("-t", "--threshold", dest="threshold", type=float, help="best time ratio above which --compare reports a regression [default: %(default)s]", metavar="RATIO")
+    parser.set_defaults(scales="1,10,100", repeat=5, threshold=1.2)
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    results = {
+        "version": RESULTS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": _get_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": [],
+        "memory": [],
+    }
+    for scale in scales:
+        workload = Workload(scale)
+        memory = item_store_size(workload)
+        results["memory"].append(memory)
+        sys.stderr.write("{0:<45} {1:>5} {2:>10} bytes ({3} items)\n"
+                         .format("item store", scale, memory["bytes"], memory["items"]))
+        sys.stderr.write("{0:<45} {1:>5} {2:>10} bytes ({3} items)\n"
+                         .format("item store: Item + dict (before)", scale, memory["bytes_before"],
+                                 memory["items"]))
+        for benchmark_cls in BENCHMARKS:
+            if args.filter and args.filter not in benchmark_cls.name:
+                continue
+            if not benchmark_cls.scaled and scale != scales[0]:
+                continue
+            result = run_benchmark(benchmark_cls(workload), args.repeat)
+            results["results"].append(result)
+            sys.stderr.write("{0:<45} {1:>5} {2:>10.4f}s ({3} units)\n"
+                             .format(result["name"], scale, result["best"], result["units"]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
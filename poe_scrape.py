@@ -23,17 +23,18 @@ Scrapes PoE web sites for item data.
 from __future__ import print_function
 
 import os
+import re
 import sys
+import copy
+import time
 
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 
-from twisted.internet import reactor
-from scrapy.crawler import Crawler
-from scrapy import log, signals
-from scrapy.utils.project import get_project_settings
-
-from scrapy_engine.spiders.gamepedia import GamepediaSpider
+# scrapy and twisted are imported once a crawl starts, --version, 
+# --list-spiders and query don't need them
+from scrapy_engine import registry
+from scrapy_engine.timings import stage_timings
 
 __all__ = []
 __version__ = '0.1'
@@ -45,11 +46,6 @@ TESTRUN = 0 or os.environ.get('TestRunLevel', 0)
 PROFILE = 0 or os.environ.get('ProfileLevel', 0)
 
 __g_scrapy = None
-__g_spiders = [{
-    'name': 'gamepedia',
-    'target_domain': 'http://pathofexile.gamepedia.com',
-    'class': GamepediaSpider
-}]
 
 
 class CLIError(Exception):
@@ -64,27 +60,118 @@ class CLIError(Exception):
 
 
 class Scrapy(object):
-    def __init__(self, settings):
+    '''
+    Runs one crawler per spider class on the shared reactor, each with 
+    its own pipeline and processor, and stops the reactor once the 
+    last spider has closed.
+    '''
+    
+    # settings that would collide between spiders running at the same time
+    per_spider_dirs = ('OUTPATH', 'ARCHIVE_RECORD_DIR', 'ARCHIVE_REPLAY_DIR')
+    per_spider_files = ('CATEGORY_STORE_FILE', 'TRANSFORM_CACHE_FILE', 'RECENT_CHANGES_STATE_FILE')
+    
+    def __init__(self, settings, spider_classes):
+        from scrapy import signals
+        from scrapy.crawler import Crawler
         super(Scrapy, self).__init__()
         self.settings = settings
-        self.spider = GamepediaSpider()
-        self.crawler = Crawler(self.settings)
-        self.crawler.signals.connect(reactor.stop, signal=signals.spider_closed)  # @UndefinedVariable
-        self.crawler.configure()
-        self.crawler.crawl(self.spider)
-
-    def get_spider(self):
-        return self.spider
+        self.spiders = []
+        self.crawlers = []
+        self.running = set()
+        for spider_cls in spider_classes:
+            spider = spider_cls()
+            crawler_settings = settings
+            if len(spider_classes) > 1:
+                crawler_settings = self.get_spider_settings(settings, spider.name)
+            crawler = Crawler(crawler_settings)
+            crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)  # @UndefinedVariable
+            crawler.configure()
+            crawler.crawl(spider)
+            self.spiders.append(spider)
+            self.crawlers.append(crawler)
+            self.running.add(spider)
+    
+    @classmethod
+    def get_spider_settings(cls, settings, spider_name):
+        '''Copy of settings with output and state paths moved into a subdir per spider.'''
+        spider_settings = copy.deepcopy(settings)
+        for name in cls.per_spider_dirs:
+            path = settings.get(name)
+            if path:
+                spider_settings.set(name, os.path.join(path, spider_name))
+        for name in cls.per_spider_files:
+            path = settings.get(name)
+            if path:
+                spider_settings.set(name, os.path.join(os.path.dirname(path), spider_name, os.path.basename(path)))
+        return spider_settings
+
+    def get_spiders(self):
+        return self.spiders
+    
+    def get_crawlers(self):
+        return self.crawlers
+    
+    def spider_closed(self, spider):
+        from twisted.internet import reactor
+        self.running.discard(spider)
+        if not self.running:
+            reactor.stop()  # @UndefinedVariable
     
-    def get_crawler(self):
-        return self.crawler
+    def stop(self):
+        for crawler in self.crawlers:
+            crawler.stop()
     
     def start(self):
-        self.crawler.start()
+        from twisted.internet import reactor
+        from scrapy import log
+        wall = time.time()
+        cpu = time.clock()
+        for crawler in self.crawlers:
+            crawler.start()
         log.start(loglevel=self.settings.get('LOG_LEVEL', 'INFO'))
-        reactor.run() # the script will block here until the spider_closed signal was sent @UndefinedVariable
+        reactor.run() # the script will block here until the last spider_closed signal was sent @UndefinedVariable
+        if stage_timings.enabled:
+            # log.start redirected sys.stdout into the log
+            print(stage_timings.report(time.time() - wall, time.clock() - cpu), file=sys.__stdout__)
+            for path in stage_timings.save_profiles():
+                print("Wrote {}".format(path), file=sys.__stdout__)
         
     
+def query(argv):
+    '''Look up items in the Uniques.sqlite written with --formats sqlite.'''
+    parser = ArgumentParser(prog="poe_scrape.py query", 
+                            description="Look up unique items in a database written with --formats sqlite.")
+    parser.add_argument("text", nargs="?", help="full-text query over the mod lines in SQLite FTS4 syntax, e.g. 'cold resistance' or 'life OR mana'")
+    parser.add_argument("-c", "--category", dest="category", help="only items of this category, %% matches anything", metavar="NAME")
+    parser.add_argument("-n", "--name", dest="name", help="only items with this name, %% matches anything", metavar="NAME")
+    parser.add_argument("-m", "--min-value", dest="min_value", type=float, help="only items with a mod value reaching N (the same mod as TEXT if given)", metavar="N")
+    parser.add_argument("-l", "--limit", dest="limit", type=int, help="return at most N items", metavar="N")
+    parser.add_argument("-d", "--db", dest="db", help="path to the database [default: %(default)s]", metavar="path")
+    parser.set_defaults(db=os.path.join("output", "Uniques.sqlite"))
+    args = parser.parse_args(argv)
+    
+    import sqlite3
+    from scrapy_engine.database import UniquesDatabase
+    if not os.path.exists(args.db):
+        raise CLIError("No database at {} (write one with --formats sqlite)".format(args.db))
+    to_unicode = lambda text: text.decode('utf-8') if text is not None else None
+    start = time.time()
+    try:
+        results = UniquesDatabase(args.db).query(to_unicode(args.text), to_unicode(args.category), 
+                                                 to_unicode(args.name), args.min_value, args.limit)
+    except sqlite3.Error as e:
+        raise CLIError("Query failed: {}".format(e))
+    elapsed = time.time() - start
+    for item, mods in results:
+        print(u"{} ({})".format(item['name'], item['category']).encode('utf-8'))
+        for mod in mods:
+            variant = u"-{}- ".format(mod['variant']) if mod['variant'] else u""
+            implicit = u"@" if mod['implicit'] else u""
+            print(u"    {}{}{}".format(variant, implicit, mod['line']).encode('utf-8'))
+    print("{} items ({:.1f} ms)".format(len(results), elapsed * 1000), file=sys.stderr)
+    return 0
+
+
 def main(argv=None):  # IGNORE:C0111
     if isinstance(argv, list):
         sys.argv.extend(argv)
@@ -111,14 +198,27 @@ USAGE
 ''' % (program_shortdesc, str(__date__))
     
     try:
+        if len(sys.argv) > 1 and sys.argv[1] == "query":
+            return query(sys.argv[2:])
+        
         # Setup argument parser
         parser = ArgumentParser(description=program_license, formatter_class=RawDescriptionHelpFormatter)
         parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="set verbosity level [default: %(default)s]")
         parser.add_argument("-i", "--include", dest="include", help="only include URLs matching this regex pattern. Note: exclude is given preference over include. [default: %(default)s]", metavar="RE" )
         parser.add_argument("-e", "--exclude", dest="exclude", help="exclude URLs matching this regex pattern. [default: %(default)s]", metavar="RE" )
-        parser.add_argument("-s", "--spider", dest="spider", help="the scrapy spider to run [default: %(default)s]", metavar="NAME" )
+        parser.add_argument("-s", "--spider", dest="spider", help="the scrapy spider to run, a comma separated list of spiders to run at the same time or 'all'. With more than one spider, output goes to a subfolder per spider. [default: %(default)s]", metavar="NAME" )
         parser.add_argument("-l", "--list-spiders", dest="list_spiders", action='store_true', help="list known spiders and exit")
         parser.add_argument('-V', '--version', action='version', version=program_version_message)
+        parser.add_argument("--record", dest="record", help="write all downloaded responses to an archive in DIR", metavar="DIR")
+        parser.add_argument("--replay", dest="replay", help="answer all requests from the archive in DIR instead of the network. Bypasses the HTTP cache and the category store so every category is rendered.", metavar="DIR")
+        parser.add_argument("--timings", dest="timings", action='store_true', help="print wall/CPU time per stage (download, parse, process_item, transform, special_items, post_process, write, database) at shutdown")
+        parser.add_argument("--profile", dest="profile", help="like --timings, and write a cProfile dump per stage to DIR", metavar="DIR")
+        parser.add_argument("--export", dest="export", help="comma separated item export formats, one file per list and format ({0}), or 'none'. Overrides the EXPORT_FORMATS setting.".format(", ".join(registry.EXPORT_FORMATS)), metavar="FORMATS")
+        parser.add_argument("--export-threaded", dest="export_threaded", action='store_true', help="write item exports from a separate thread")
+        parser.add_argument("-f", "--formats", dest="formats", help="comma separated outputs to write: txt for Uniques.txt, sqlite for Uniques.sqlite (see '%(prog)s query --help'). Overrides the UNIQUES_FORMATS setting.", metavar="FORMATS")
+        parser.add_argument("-w", "--workers", dest="workers", type=int, help="render the Uniques.txt categories in N processes. Overrides the RENDER_WORKERS setting.", metavar="N")
+        parser.add_argument("--changes", dest="changes", action='store_true', help="only download the pages edited on the wiki since the last crawl, according to its recent changes, and take the others from the HTTP cache")
+        parser.add_argument("--watch", dest="watch", type=float, help="keep running and crawl again every INTERVAL seconds, writing Uniques.txt only when it changed. Overrides the WATCH_INTERVAL setting.", metavar="INTERVAL")
         parser.add_argument('-o', '--outdir', dest="outdir", help="path to output folder [default: %(default)s]", metavar="path")
         
         parser.set_defaults(outdir="output", spider="gamepedia")
@@ -132,25 +232,85 @@ USAGE
         expat = args.exclude
         spider = args.spider
         list_spiders = args.list_spiders
-                
-        settings = get_project_settings()
+        record_dir = args.record
+        timings = args.timings
+        profile_dir = args.profile
+        replay_dir = args.replay
+        workers = args.workers
+        formats = args.formats
+        export = args.export
+        export_threaded = args.export_threaded
+        watch = args.watch
+        changes = args.changes
         
         if list_spiders is True:
-            spiders_list = ["   {} -> {}".format(s['name'], s['target_domain']) for s in __g_spiders]
+            spiders_list = ["   {} -> {}".format(s['name'], s['target_domain']) for s in registry.SPIDERS]
             print("List of known spiders: {0}".format(os.linesep))
             print(", ".join(spiders_list))
             return 0
         
-        if (spider not in [s["name"] for s in __g_spiders]):
-            raise CLIError("Unknown spider: {} (known spiders: {})".format(spider, (", ".join([s["name"] for s in __g_spiders]))))
+        known_spiders = [s["name"] for s in registry.SPIDERS]
+        if spider == "all":
+            spider_names = known_spiders
+        else:
+            spider_names = [name.strip() for name in spider.split(",")]
+        for name in spider_names:
+            if name not in known_spiders:
+                raise CLIError("Unknown spider: {} (known spiders: {})".format(name, ", ".join(known_spiders)))
         
         if inpat and expat and inpat == expat:
             raise CLIError("Include and exclude patterns are equal! Nothing will be processed.")
         
+        for option, pattern in (("include", inpat), ("exclude", expat)):
+            if pattern:
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    raise CLIError("Invalid {} pattern {!r}: {}".format(option, pattern, e))
+        
+        export_formats = None
+        if export is not None:
+            export_formats = [name.strip() for name in export.split(",") if name.strip() and name.strip() != "none"]
+            for name in export_formats:
+                if name not in registry.EXPORT_FORMATS:
+                    raise CLIError("Unknown export format: {} (known formats: {})".format(name, ", ".join(registry.EXPORT_FORMATS)))
+        
+        if formats is not None:
+            formats = [name.strip() for name in formats.split(",") if name.strip()]
+            for name in formats:
+                if name not in registry.UNIQUES_FORMATS:
+                    raise CLIError("Unknown output format: {} (known formats: {})".format(name, ", ".join(registry.UNIQUES_FORMATS)))
+            if not formats:
+                raise CLIError("No output format given.")
+        
+        if workers is not None and workers < 0:
+            raise CLIError("Number of workers can't be negative.")
+        
+        if watch is not None and watch <= 0:
+            raise CLIError("Watch interval must be positive.")
+        
+        if record_dir and replay_dir:
+            raise CLIError("Can't record and replay at the same time.")
+        
+        if changes and replay_dir:
+            raise CLIError("Can't replay only the recent changes, replay answers every request from the archive.")
+        
+        if replay_dir:
+            from scrapy_engine.archive import ResponseArchive
+            for name in spider_names:
+                archive_dir = replay_dir if len(spider_names) == 1 else os.path.join(replay_dir, name)
+                if not ResponseArchive.exists(archive_dir):
+                    raise CLIError("No archive to replay in {}".format(archive_dir))
+        
         if verbose > 0:
             print("Verbose mode on")
         
+        from scrapy import log
+        from scrapy.utils.misc import load_object
+        from scrapy.utils.project import get_project_settings
+        settings = get_project_settings()
         settings.set("VERBOSE", verbose)
+        settings.set("DEBUG", DEBUG)
 
         if DEBUG > 0:
             settings.set("LOG_LEVEL", log.DEBUG)
@@ -163,19 +323,44 @@ USAGE
         else:
             settings.set("OUTPATH", outdir)
         
+        if timings or profile_dir:
+            # before the crawler is set up, the timing middlewares check it
+            stage_timings.enable(profile_dir)
+        
+        if workers is not None:
+            settings.set("RENDER_WORKERS", workers)
+        if formats is not None:
+            settings.set("UNIQUES_FORMATS", formats)
+        if export_formats is not None:
+            settings.set("EXPORT_FORMATS", export_formats)
+        if export_threaded:
+            settings.set("EXPORT_THREADED", True)
+        if watch is not None:
+            settings.set("WATCH_INTERVAL", watch)
+        if changes:
+            settings.set("RECENT_CHANGES_ENABLED", True)
+        
+        if record_dir:
+            settings.set("ARCHIVE_RECORD_DIR", record_dir)
+        if replay_dir:
+            settings.set("ARCHIVE_REPLAY_DIR", replay_dir)
+            settings.set("HTTPCACHE_ENABLED", False)
+            settings.set("CATEGORY_STORE_FILE", None)
+        
         if inpat:
             settings.set("INCLUDE_PATTERN", inpat)
         if expat:
             settings.set("EXCLUDE_PATTERN", expat)
         
         global __g_scrapy
-        __g_scrapy = Scrapy(settings)
+        spider_classes = [load_object(s['class']) for name in spider_names for s in registry.SPIDERS if s['name'] == name]
+        __g_scrapy = Scrapy(settings, spider_classes)
         __g_scrapy.start()
         
         return 0
     except KeyboardInterrupt:
         if (__g_scrapy is not None):
-            __g_scrapy.get_crawler().stop()
+            __g_scrapy.stop()
         return 0
     except CLIError as e:
         print(e)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# Crawl archive for the ArchiveMiddleware
+#
+# Written with poe_scrape.py --record DIR, read back with --replay DIR
+
+import os
+import mmap
+import zlib
+import cPickle as pickle
+
+from scrapy import log
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+
+class ResponseArchive(object):
+    '''
+    Responses of a crawl, stored as zlib compressed pickles appended to
+    a single data file, plus an index mapping each request fingerprint
+    to the (offset, length) of its record.
+
+    Opened for reading, the data file is memory-mapped, so looking up a
+    response is a dict access and a slice of the map.
+
+    A recording is written aside and only replaces the archive at path
+    on close(). discard() drops it instead, so an interrupted recording
+    leaves the previous archive as it was.
+    '''
+
+    data_filename = "responses.dat"
+    index_filename = "index.pickle"
+
+    def __init__(self, path, compress_level=6):
+        super(ResponseArchive, self).__init__()
+        self.path = path
+        self.compress_level = compress_level
+        self.index = {}
+        self._datafile = None
+        self._mmap = None
+        self._offset = 0
+        self._writing = False
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(os.path.join(path, cls.index_filename))
+
+    def open_write(self):
+        '''Start a new archive, replacing the one that may be at path on close().'''
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._datafile = open(os.path.join(self.path, self.data_filename + ".tmp"), 'wb')
+        self._offset = 0
+        self._writing = True
+        self.index = {}
+
+    def open_read(self):
+        with open(os.path.join(self.path, self.index_filename), 'rb') as f:
+            self.index = pickle.load(f)
+        self._datafile = open(os.path.join(self.path, self.data_filename), 'rb')
+        self._writing = False
+        if os.fstat(self._datafile.fileno()).st_size > 0: # empty files can't be mapped
+            self._mmap = mmap.mmap(self._datafile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self._writing:
+            self._datafile.close()
+            datapath = os.path.join(self.path, self.data_filename)
+            indexpath = os.path.join(self.path, self.index_filename)
+            with open(indexpath + ".tmp", 'wb') as f:
+                pickle.dump(self.index, f, pickle.HIGHEST_PROTOCOL)
+            # the old index goes first and the new one last, so the data
+            # file is never paired with an index that doesn't belong to it
+            if os.path.exists(indexpath):
+                os.remove(indexpath)
+            if os.name == 'nt' and os.path.exists(datapath):
+                os.remove(datapath) # rename doesn't replace files on Windows
+            os.rename(datapath + ".tmp", datapath)
+            os.rename(indexpath + ".tmp", indexpath)
+        else:
+            if self._mmap is not None:
+                self._mmap.close()
+            if self._datafile is not None:
+                self._datafile.close()
+        self._mmap = None
+        self._datafile = None
+        self._writing = False
+
+    def discard(self):
+        '''Drop the recording started by open_write(), keeping the archive already at path.'''
+        if self._writing:
+            self._datafile.close()
+            datapath = os.path.join(self.path, self.data_filename + ".tmp")
+            if os.path.exists(datapath):
+                os.remove(datapath)
+        self._datafile = None
+        self._writing = False
+        self.index = {}
+
+    def put(self, key, response):
+        if key in self.index:
+            return
+        record = zlib.compress(pickle.dumps((response.url, response.status,
+                                             dict(response.headers), response.body),
+                                            protocol=2), self.compress_level)
+        self._datafile.write(record)
+        self.index[key] = (self._offset, len(record))
+        self._offset += len(record)
+
+    def get(self, key):
+        '''Return the archived response for key, or None if there is none.'''
+        entry = self.index.get(key)
+        if entry is None or self._mmap is None:
+            return None
+        offset, length = entry
+        try:
+            url, status, headers, body = pickle.loads(zlib.decompress(self._mmap[offset:offset+length]))
+        except (zlib.error, pickle.UnpicklingError, EOFError, ValueError, TypeError) as e:
+            log.msg("Ignoring unreadable archive record {0} in {1}: {2}".format(key, self.path, e),
+                    level=log.WARNING)
+            return None
+        headers = Headers(headers)
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status, body=body)
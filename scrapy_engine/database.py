@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# SQLite output of the UniqueItemsProcessor, queried by poe_scrape.py query
+#
+# Written next to Uniques.txt when UNIQUES_FORMATS contains 'sqlite'
+
+import os
+import re
+import sqlite3
+
+
+_RANGE_RE = re.compile(r"^(-?[0-9.]+)(?:-([0-9.]+))?$")
+
+# mods are found through their own table, the FTS table only indexes the lines
+_SCHEMA = '''
+CREATE TABLE items (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL COLLATE NOCASE,
+    category TEXT NOT NULL COLLATE NOCASE,
+    url TEXT
+);
+CREATE TABLE mods (
+    id INTEGER PRIMARY KEY,
+    item_id INTEGER NOT NULL REFERENCES items(id),
+    position INTEGER NOT NULL,
+    implicit INTEGER NOT NULL,
+    variant TEXT,
+    value TEXT,
+    text TEXT NOT NULL,
+    line TEXT NOT NULL
+);
+CREATE TABLE mod_ranges (
+    mod_id INTEGER NOT NULL REFERENCES mods(id),
+    position INTEGER NOT NULL,
+    low REAL NOT NULL,
+    high REAL NOT NULL
+);
+'''
+
+# created after the bulk insert, which is faster than updating them row by row,
+# name and category take the NOCASE collation of their columns
+_INDEXES = '''
+CREATE INDEX items_name ON items(name);
+CREATE INDEX items_category ON items(category);
+CREATE INDEX mods_item ON mods(item_id);
+CREATE INDEX mod_ranges_mod ON mod_ranges(mod_id);
+'''
+
+
+def match_clause(column, pattern):
+    '''
+    Condition for column matching pattern ignoring case, = without
+    wildcards so that the NOCASE index of column can be searched.
+    '''
+    if u"%" in pattern or u"_" in pattern:
+        return "{0} LIKE ?".format(column)
+    return "{0} = ?".format(column)
+
+
+def parse_value_ranges(value):
+    '''
+    Return the (low, high) ranges of a value as ValueTransform formats
+    them, e.g. "10", "10-20", "-(10-20)" or "5-10,15-20", or None if
+    value is none of these.
+    '''
+    negative = value.startswith("-(") and value.endswith(")")
+    if negative:
+        value = value[2:-1]
+    ranges = []
+    for part in value.split(","):
+        match = _RANGE_RE.match(part)
+        if match is None:
+            return None
+        try:
+            low = float(match.group(1))
+            high = float(match.group(2)) if match.group(2) else low
+        except ValueError:
+            return None
+        if negative:
+            low, high = -high, -low
+        ranges.append((low, high))
+    return ranges
+
+
+def split_mod(line, value_separator=":"):
+    '''Split a transformed mod line into (value, text, ranges), value and ranges are None for plain text.'''
+    value, sep, text = line.partition(value_separator)
+    if sep:
+        ranges = parse_value_ranges(value)
+        if ranges is not None:
+            return value, text, ranges
+    return None, line, None
+
+
+class UniquesDatabase(object):
+    '''
+    Items with their transformed mods, one row per mod, and the numeric
+    ranges of each mod's value, plus a full-text index over the mod lines
+    (mods_fts, if the SQLite library comes with FTS4).
+
+    Imports nothing but the standard library, poe_scrape.py query 
+    starts without loading scrapy.
+
+    write() builds a new database next to path and moves it into place,
+    readers never see a half-written one.
+    '''
+
+    fts_table = "mods_fts"
+
+    def __init__(self, path):
+        super(UniquesDatabase, self).__init__()
+        self.path = path
+
+    def write(self, items):
+        '''
+        items are (name, category, url, mods) in output order, mods a list 
+        of (implicit, variant, line) with line as ValueTransform et al. left
+        it. All text as unicode. Returns the number of items and mods
+        written and whether the full-text index could be created.
+        '''
+        tmppath = "{0}.tmp".format(self.path)
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        conn = sqlite3.connect(tmppath)
+        try:
+            conn.executescript(_SCHEMA)
+            num_items, num_mods = self._insert(conn, items)
+            conn.executescript(_INDEXES)
+            has_fts = self._create_fts(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path) # rename doesn't replace files on Windows
+        os.rename(tmppath, self.path)
+        return num_items, num_mods, has_fts
+
+    def _insert(self, conn, items):
+        num_items = 0
+        mod_id = 0
+        for item_id, (name, category, url, mods) in enumerate(items, 1):
+            conn.execute("INSERT INTO items (id, position, name, category, url) VALUES (?, ?, ?, ?, ?)",
+                         (item_id, item_id, name, category, url))
+            num_items += 1
+            for position, (implicit, variant, line) in enumerate(mods):
+                mod_id += 1
+                value, text, ranges = split_mod(line)
+                conn.execute("INSERT INTO mods (id, item_id, position, implicit, variant, value, text, line) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (mod_id, item_id, position, int(implicit), variant, value, text.strip(), line))
+                if ranges:
+                    conn.executemany("INSERT INTO mod_ranges (mod_id, position, low, high) VALUES (?, ?, ?, ?)",
+                                     [(mod_id, i, low, high) for i, (low, high) in enumerate(ranges)])
+        return num_items, mod_id
+
+    def _create_fts(self, conn):
+        try:
+            conn.execute("CREATE VIRTUAL TABLE {0} USING fts4(line)".format(self.fts_table))
+        except sqlite3.OperationalError:
+            return False # SQLite built without FTS4
+        conn.execute("INSERT INTO {0} (docid, line) SELECT id, line FROM mods".format(self.fts_table))
+        return True
+
+    def has_fts(self, conn):
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (self.fts_table,)).fetchone() is not None
+
+    def query(self, text=None, category=None, name=None, min_value=None, limit=None):
+        '''
+        Return (item row, mod rows) of the items matching all of the given
+        criteria, in output order. text is an FTS4 query over the mod lines
+        (a substring without FTS), name and category are matched ignoring
+        case, '%' and '_' work as wildcards. min_value matches mods with
+        a range reaching it, together with text it has to be the same mod.
+        '''
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        try:
+            joins = []
+            where = []
+            params = []
+            if text or min_value is not None:
+                joins.append("JOIN mods ON mods.item_id = items.id")
+            if text:
+                if self.has_fts(conn):
+                    joins.append("JOIN {0} ON {0}.docid = mods.id".format(self.fts_table))
+                    where.append("{0}.line MATCH ?".format(self.fts_table))
+                    params.append(text)
+                else:
+                    where.append("mods.line LIKE ?")
+                    params.append(u"%{0}%".format(text))
+            if min_value is not None:
+                joins.append("JOIN mod_ranges ON mod_ranges.mod_id = mods.id")
+                where.append("mod_ranges.high >= ?")
+                params.append(min_value)
+            if category:
+                where.append(match_clause("items.category", category))
+                params.append(category)
+            if name:
+                where.append(match_clause("items.name", name))
+                params.append(name)
+            sql = "SELECT DISTINCT items.* FROM items {0}".format(" ".join(joins))
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            sql += " ORDER BY items.position"
+            if limit:
+                sql += " LIMIT {0:d}".format(limit)
+            items = conn.execute(sql, params).fetchall()
+            mods = dict((item['id'], []) for item in items)
+            item_ids = [item['id'] for item in items]
+            # older SQLite versions allow no more than 999 parameters per statement
+            for i in xrange(0, len(item_ids), 500):
+                chunk = item_ids[i:i+500]
+                for mod in conn.execute("SELECT * FROM mods WHERE item_id IN ({0}) ORDER BY item_id, position"
+                                        .format(",".join("?" * len(chunk))), chunk):
+                    mods[mod['item_id']].append(mod)
+            return [(item, mods[item['id']]) for item in items]
+        finally:
+            conn.close()
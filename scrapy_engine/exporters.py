@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# Item exports of the PoeScrapyPipeline
+#
+# One file per unique item list and format, see the EXPORT_* settings
+# See: http://doc.scrapy.org/en/latest/topics/exporters.html
+
+import os
+import sys
+import threading
+from Queue import Queue
+
+from scrapy import log
+from scrapy.utils.misc import load_object
+from scrapy_engine.registry import EXPORT_FORMATS
+
+
+class BatchedItemExporter(object):
+    '''
+    Exports items to <outdir>/<list_path><ext> for each of the given
+    formats (see EXPORT_FORMATS).
+
+    The files of the lists passed to open() are created right away,
+    those of other lists when their first item comes in. Items are
+    buffered per list and handed to the item exporters batch_size at a
+    time. If threaded, batches are written by a separate thread, in the
+    order they were queued, and export_item only appends to a list.
+    
+    Files are written aside and renamed into place on close(). abort()
+    throws them away instead, so an interrupted crawl leaves the exports
+    of the last complete one as they were. After close() or abort() the
+    exporter can be opened again (see WATCH_INTERVAL).
+    '''
+
+    buffer_size = 64 * 1024
+
+    def __init__(self, outdir, formats, batch_size=100, threaded=False):
+        super(BatchedItemExporter, self).__init__()
+        unknown = [name for name in formats if name not in EXPORT_FORMATS]
+        if unknown:
+            raise ValueError("Unknown export format(s): {0} (known formats: {1})"
+                             .format(", ".join(unknown), ", ".join(EXPORT_FORMATS)))
+        self.outdir = outdir
+        self.formats = [(load_object(EXPORT_FORMATS[name][0]), EXPORT_FORMATS[name][1]) 
+                        for name in formats]
+        self.batch_size = max(1, batch_size)
+        self.threaded = threaded
+        self.exporters = {}
+        self.pending = {}
+        self.files = []
+        self.exported = 0
+        self._queue = None
+        self._thread = None
+        self._error = None
+
+    def __len__(self):
+        return self.exported
+
+    def open(self, list_paths=()):
+        if not self.formats:
+            return
+        self.exported = 0
+        if not os.path.exists(self.outdir):
+            os.makedirs(self.outdir)
+        for list_path in list_paths:
+            if list_path not in self.exporters:
+                self._open_list(list_path)
+        if self.threaded:
+            self._queue = Queue()
+            self._thread = threading.Thread(target=self._run, name="BatchedItemExporter")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _open_list(self, list_path):
+        exporters = []
+        for exporter_cls, ext in self.formats:
+            path = os.path.join(self.outdir, list_path + ext)
+            outfile = open("{0}.tmp".format(path), 'wb', self.buffer_size)
+            self.files.append((outfile, path))
+            exporter = exporter_cls(outfile)
+            exporter.start_exporting()
+            exporters.append(exporter)
+        self.exporters[list_path] = exporters
+        self.pending[list_path] = []
+
+    def export_item(self, item):
+        if not self.formats:
+            return
+        list_path = item['list_path']
+        pending = self.pending.get(list_path)
+        if pending is None:
+            self._open_list(list_path)
+            pending = self.pending[list_path]
+        pending.append(item)
+        if len(pending) >= self.batch_size:
+            self._flush(list_path)
+
+    def _flush(self, list_path):
+        batch = self.pending[list_path]
+        if not batch:
+            return
+        self.pending[list_path] = []
+        self.exported += len(batch)
+        if self._queue is not None:
+            self._queue.put((self.exporters[list_path], batch))
+        else:
+            self._write(self.exporters[list_path], batch)
+
+    def _write(self, exporters, batch):
+        for exporter in exporters:
+            for item in batch:
+                exporter.export_item(item)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            if self._error is not None:
+                continue # keep draining, close() reports the error
+            try:
+                self._write(*job)
+            except Exception:
+                self._error = sys.exc_info()
+
+    def _stop_thread(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._queue = None
+
+    def close(self):
+        for list_path in self.pending:
+            self._flush(list_path)
+        self._stop_thread()
+        for exporters in self.exporters.itervalues():
+            for exporter in exporters:
+                exporter.finish_exporting()
+        for outfile, _ in self.files:
+            outfile.close()
+        files, self.files = self.files, []
+        exporters, self.exporters, self.pending = self.exporters, {}, {}
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error[0], error[1], error[2]
+        for outfile, path in files:
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path) # rename doesn't replace files on Windows
+            os.rename(outfile.name, path)
+        if self.formats:
+            log.msg("Exported {0} items to {1} file(s) in {2}"
+                    .format(self.exported, len(exporters) * len(self.formats), self.outdir),
+                    level=log.INFO)
+
+    def abort(self):
+        '''Stop exporting and delete the files written since open(), without renaming them.'''
+        self._stop_thread()
+        for outfile, _ in self.files:
+            outfile.close()
+            if os.path.exists(outfile.name):
+                os.remove(outfile.name)
+        self.files = []
+        self.exporters, self.pending = {}, {}
+        self._error = None
+        if self.formats:
+            log.msg("Discarded the exports of {0} items".format(self.exported), level=log.INFO)
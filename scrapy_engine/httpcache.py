@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# HTTP cache policy and storage for the HttpCacheMiddleware
+#
+# Enabled through the HTTPCACHE_* settings
+# See: http://doc.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+
+import os
+import zlib
+import errno
+import cPickle as pickle
+from time import time
+
+from scrapy import log
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.request import request_fingerprint
+from scrapy.utils.project import data_path
+from scrapy.contrib.httpcache import RFC2616Policy
+
+
+class RevalidatePolicy(RFC2616Policy):
+    '''
+    RFC2616Policy that never trusts a cached response without asking
+    the server: every cached page is revalidated with If-None-Match/
+    If-Modified-Since and served from the cache on a 304.
+
+    The wiki may change at any time, the heuristic freshness RFC2616Policy
+    derives from Last-Modified would keep serving old pages for weeks.
+    Requests marked ``unchanged`` in their meta are the exception, the 
+    wiki's recent changes say they weren't edited (see RecentChanges).
+    '''
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if request.meta.get('unchanged'):
+            return True
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+
+class CompressedCacheStorage(object):
+    '''
+    Stores each response as a zlib compressed pickle, one file per request
+    below HTTPCACHE_DIR/<spider name>.
+
+    Once the files of a spider take up more than HTTPCACHE_MAX_SIZE bytes
+    (0 for no limit), the least recently used ones are evicted. The size
+    is kept as a running total of what was stored, so this also holds 
+    for spiders that never close (poe_scrape.py --watch). Eviction goes
+    a bit below the limit, to not walk the cache after every response.
+    '''
+
+    evict_ratio = 0.9
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'])
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.max_size = settings.getint('HTTPCACHE_MAX_SIZE', 0)
+        self.compress_level = settings.getint('HTTPCACHE_COMPRESS_LEVEL', 6)
+        self.total_size = 0
+
+    def open_spider(self, spider):
+        spiderdir = os.path.join(self.cachedir, spider.name)
+        if not os.path.exists(spiderdir):
+            os.makedirs(spiderdir)
+        if self.max_size > 0:
+            self._evict(spider)
+
+    def close_spider(self, spider):
+        if self.max_size > 0:
+            self._evict(spider)
+
+    def retrieve_response(self, spider, request):
+        '''Return response if present in cache, or None otherwise.'''
+        data = self._read_data(spider, request)
+        if data is None:
+            return # not cached
+        url = data['url']
+        headers = Headers(data['headers'])
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=data['status'], body=data['body'])
+
+    def store_response(self, spider, request, response):
+        '''Store the given response in the cache.'''
+        path = self._get_request_path(spider, request)
+        data = {
+            'url': response.url,
+            'status': response.status,
+            'headers': dict(response.headers),
+            'body': response.body,
+            'timestamp': time(),
+        }
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        # write aside and rename, so an interrupted run never leaves a truncated entry
+        tmppath = "{0}.tmp".format(path)
+        with open(tmppath, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(data, protocol=2), self.compress_level))
+        if self.max_size > 0:
+            self.total_size += os.path.getsize(tmppath)
+            if os.path.exists(path):
+                self.total_size -= os.path.getsize(path)
+        os.rename(tmppath, path)
+        if 0 < self.max_size < self.total_size:
+            self._evict(spider, int(self.max_size * self.evict_ratio))
+
+    def _get_request_path(self, spider, request):
+        key = request_fingerprint(request)
+        return os.path.join(self.cachedir, spider.name, key[0:2], key)
+
+    def _read_data(self, spider, request):
+        path = self._get_request_path(spider, request)
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.loads(zlib.decompress(f.read()))
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return # not found
+        except (zlib.error, pickle.UnpicklingError, EOFError):
+            return # corrupt entry, will be overwritten
+        if 0 < self.expiration_secs < time() - data['timestamp']:
+            return # expired
+        # mark as recently used for eviction
+        os.utime(path, None)
+        return data
+
+    def _evict(self, spider, target_size=None):
+        '''Remove the least recently used entries beyond max_size, down to target_size.'''
+        if target_size is None:
+            target_size = self.max_size
+        entries = []
+        total_size = 0
+        for dirpath, _, filenames in os.walk(os.path.join(self.cachedir, spider.name)):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+                total_size += st.st_size
+        self.total_size = total_size
+        if total_size <= self.max_size:
+            return
+        entries.sort()
+        evicted = 0
+        for _, size, path in entries:
+            if total_size <= target_size:
+                break
+            os.remove(path)
+            total_size -= size
+            evicted += 1
+        self.total_size = total_size
+        log.msg("HTTP cache: evicted {0} entries, {1} bytes left".format(evicted, total_size),
+                level=log.INFO, spider=spider)
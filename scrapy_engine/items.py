@@ -28,4 +28,36 @@ class UniqueItem(scrapy.Item):
     affix_mods = scrapy.Field() 
     url = scrapy.Field()
     category = scrapy.Field()
-    
\ No newline at end of file
+    list_path = scrapy.Field()
+
+
+class SpecialItemDetails(scrapy.Item):
+    '''
+    Mods scraped from the detail page of a unique item 
+    that only says "<Style Variant>" or "see notes" in 
+    its unique item list.
+    
+    ``variants`` holds (variant name, mods) pairs if the 
+    page lists variants, ``mods`` the plain mods otherwise.
+    '''
+    name = scrapy.Field()
+    url = scrapy.Field()
+    category = scrapy.Field()
+    variants = scrapy.Field()
+    mods = scrapy.Field()
+
+
+SPECIAL_ITEM_MARKERS = ("<Style Variant>", "see notes")
+
+
+def is_special_item(item):
+    '''True if the mods of a UniqueItem are found on its detail page only.'''
+    for mod in item['affix_mods']:
+        for marker in SPECIAL_ITEM_MARKERS:
+            if marker in mod:
+                return True
+    for mod in item['implicit_mods']:
+        for marker in SPECIAL_ITEM_MARKERS:
+            if marker in mod:
+                return True
+    return False
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+# Define your spider and downloader middlewares here
+#
+# Don't forget to add your middleware to the SPIDER_MIDDLEWARES or
+# DOWNLOADER_MIDDLEWARES setting
+# See: http://doc.scrapy.org/en/latest/topics/spider-middleware.html
+#      http://doc.scrapy.org/en/latest/topics/downloader-middleware.html
+
+import re
+import time
+from email.utils import parsedate_tz, mktime_tz
+from scrapy import log, signals
+from scrapy.exceptions import NotConfigured, IgnoreRequest
+from scrapy.utils.request import request_fingerprint
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.contrib.downloadermiddleware.httpcache import HttpCacheMiddleware
+from scrapy_engine.archive import ResponseArchive
+from scrapy_engine.timings import stage_timings
+
+
+class UrlFilterMiddleware(object):
+    '''
+    Drops start requests whose URL is excluded by the EXCLUDE_PATTERN
+    setting or not included by the INCLUDE_PATTERN setting (see the
+    -e/-i options of poe_scrape.py) before anything is downloaded.
+
+    Exclude is given preference over include. Works for every spider,
+    requests scheduled later on (e.g. for special items) are not filtered.
+    Neither are start requests with ``url_filtered`` set in their meta, 
+    spiders set it when they have applied is_valid_url themselves.
+    '''
+
+    def __init__(self, include_pattern=None, exclude_pattern=None):
+        super(UrlFilterMiddleware, self).__init__()
+        self.include_re = re.compile(include_pattern) if include_pattern else None
+        self.exclude_re = re.compile(exclude_pattern) if exclude_pattern else None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(settings.get('INCLUDE_PATTERN', None),
+                   settings.get('EXCLUDE_PATTERN', None))
+
+    def get_drop_reason(self, url):
+        '''Why url is dropped, or None if it passes the patterns.'''
+        if self.exclude_re is not None and self.exclude_re.search(url):
+            return "excluded by URL exclude pattern"
+        if self.include_re is not None and not self.include_re.search(url):
+            return "not included by URL include pattern"
+        return None
+
+    def is_valid_url(self, url, spider=None):
+        reason = self.get_drop_reason(url)
+        if reason is not None:
+            log.msg("Dropping %s (reason: %s)" % (url, reason),
+                    level=log.INFO, spider=spider)
+            return False
+        log.msg("Processing %s" % url, level=log.INFO, spider=spider)
+        return True
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            if request.meta.get('url_filtered') or self.is_valid_url(request.url, spider):
+                yield request
+
+
+class ReportingHttpCacheMiddleware(HttpCacheMiddleware):
+    '''
+    HttpCacheMiddleware that logs how many responses were served from the
+    cache after revalidation (304) or without asking (unchanged according 
+    to the recent changes) versus downloaded again when the spider closes.
+    '''
+
+    def spider_closed(self, spider):
+        super(ReportingHttpCacheMiddleware, self).spider_closed(spider)
+        get_value = lambda key: self.stats.get_value('httpcache/{0}'.format(key), 0, spider=spider)
+        log.msg("HTTP cache: {0} unchanged, {1} revalidated, {2} refetched, {3} new"
+                .format(get_value('hit'), get_value('revalidate'), get_value('invalidate'), 
+                        get_value('firsthand')),
+                level=log.INFO, spider=spider)
+
+
+class ArchiveMiddleware(object):
+    '''
+    Records every downloaded response into a ResponseArchive at 
+    ARCHIVE_RECORD_DIR, or answers every request from the archive at 
+    ARCHIVE_REPLAY_DIR without touching the network. Requests that are 
+    not in the archive are ignored when replaying. Only a finished crawl
+    replaces the archive at ARCHIVE_RECORD_DIR.
+    '''
+
+    def __init__(self, stats, record_dir=None, replay_dir=None):
+        super(ArchiveMiddleware, self).__init__()
+        if not record_dir and not replay_dir:
+            raise NotConfigured
+        self.stats = stats
+        self.record = ResponseArchive(record_dir) if record_dir else None
+        self.replay = ResponseArchive(replay_dir) if replay_dir else None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        o = cls(crawler.stats, settings.get('ARCHIVE_RECORD_DIR', None),
+                settings.get('ARCHIVE_REPLAY_DIR', None))
+        crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_opened(self, spider):
+        if self.replay is not None:
+            self.replay.open_read()
+        if self.record is not None:
+            self.record.open_write()
+
+    def spider_closed(self, spider, reason):
+        if self.replay is not None:
+            log.msg("Replayed {0} responses from {1}"
+                    .format(self.stats.get_value('archive/replayed', 0, spider=spider), self.replay.path),
+                    level=log.INFO, spider=spider)
+            self.replay.close()
+        if self.record is not None:
+            if reason != 'finished':
+                log.msg("Crawl stopped ({0}), discarding the recording of {1} responses to {2}"
+                        .format(reason, len(self.record), self.record.path),
+                        level=log.WARNING, spider=spider)
+                self.record.discard()
+                return
+            log.msg("Recorded {0} responses to {1}".format(len(self.record), self.record.path),
+                    level=log.INFO, spider=spider)
+            self.record.close()
+
+    def process_request(self, request, spider):
+        if self.replay is None:
+            return
+        response = self.replay.get(request_fingerprint(request))
+        if response is None:
+            self.stats.inc_value('archive/missing', spider=spider)
+            raise IgnoreRequest("Not in archive: %s" % request)
+        self.stats.inc_value('archive/replayed', spider=spider)
+        response.flags.append('replayed')
+        return response
+
+    def process_response(self, request, response, spider):
+        if self.record is not None and 'replayed' not in response.flags:
+            self.record.put(request_fingerprint(request), response)
+        return response
+
+
+def parse_retry_after(value, now=None):
+    '''Seconds to wait from a Retry-After header, given as seconds or as an HTTP date, None if unreadable.'''
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - (now if now is not None else time.time()))
+
+
+def parse_crawl_delay(robots_txt, user_agent):
+    '''Crawl-delay a robots.txt asks of user_agent (or of *), None if it doesn't.'''
+    delays = {}
+    agents = []
+    in_rules = False
+    for line in robots_txt.splitlines():
+        line = line.split('#', 1)[0].strip()
+        key, sep, value = line.partition(':')
+        if not sep:
+            continue
+        key = key.strip().lower()
+        value = value.strip()
+        if key == 'user-agent':
+            if in_rules: # a new group starts
+                agents = []
+                in_rules = False
+            agents.append(value.lower())
+            continue
+        in_rules = True
+        if key == 'crawl-delay':
+            try:
+                delay = float(value)
+            except ValueError:
+                continue
+            for agent in agents:
+                delays.setdefault(agent, delay)
+    user_agent = user_agent.lower()
+    for agent in sorted(delays):
+        if agent != '*' and agent in user_agent:
+            return delays[agent]
+    return delays.get('*')
+
+
+class SlotWindow(object):
+    '''What AdaptiveConcurrencyMiddleware knows about one downloader slot.'''
+
+    def __init__(self, key, size, base_delay):
+        super(SlotWindow, self).__init__()
+        self.key = key
+        self.size = size
+        self.base_delay = base_delay
+        self.latency = None
+        self.responses = 0
+        self.grace = 0
+        self.backoff_until = 0.0
+
+
+class AdaptiveConcurrencyMiddleware(object):
+    '''
+    Adapts the concurrency of each downloader slot (i.e. each domain) 
+    to how well the server copes, growing it additively and shrinking
+    it multiplicatively:
+
+    - after each window's worth of responses, the window grows by one
+      while the average latency stays at or below 
+      ADAPTIVE_CONCURRENCY_TARGET_LATENCY and shrinks by one once it
+      rises above twice that
+    - 429 and 5xx responses and download errors halve the window, at
+      most once per window of requests in flight
+    - a Retry-After header on such a response holds the slot's next 
+      requests back that long (up to ADAPTIVE_CONCURRENCY_MAX_RETRY_AFTER)
+    - a Crawl-delay in robots.txt for USER_AGENT (or *) becomes the 
+      slot's minimum download delay, which Scrapy applies one request 
+      at a time
+
+    Slots start out at CONCURRENT_REQUESTS_PER_DOMAIN and stay within 
+    ADAPTIVE_CONCURRENCY_MIN/MAX. Every decision is counted in the crawl
+    stats under adaptive_concurrency/, along with each slot's final 
+    window and latency. Set ADAPTIVE_CONCURRENCY_DEBUG to log them too.
+    '''
+
+    latency_weight = 0.3 # of a new latency sample in the moving average
+
+    def __init__(self, crawler):
+        super(AdaptiveConcurrencyMiddleware, self).__init__()
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.min_size = max(1, settings.getint('ADAPTIVE_CONCURRENCY_MIN', 1))
+        self.max_size = max(self.min_size, settings.getint('ADAPTIVE_CONCURRENCY_MAX', 16))
+        self.target_latency = settings.getfloat('ADAPTIVE_CONCURRENCY_TARGET_LATENCY', 1.0)
+        self.max_retry_after = settings.getfloat('ADAPTIVE_CONCURRENCY_MAX_RETRY_AFTER', 120.0)
+        self.user_agent = settings.get('USER_AGENT', '')
+        self.debug = settings.getbool('ADAPTIVE_CONCURRENCY_DEBUG')
+        self.windows = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        o = cls(crawler)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_closed(self, spider):
+        for key, window in sorted(self.windows.iteritems()):
+            self.stats.set_value('adaptive_concurrency/window/{0}'.format(key), window.size, spider=spider)
+            if window.latency is not None:
+                self.stats.set_value('adaptive_concurrency/latency/{0}'.format(key), 
+                                     round(window.latency, 3), spider=spider)
+
+    def _get_window(self, request, spider):
+        '''The request's slot and its window, (None, None) if it wasn't downloaded (e.g. replayed).'''
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return None, None
+        window = self.windows.get(key)
+        if window is None:
+            size = min(max(slot.concurrency, self.min_size), self.max_size)
+            window = self.windows[key] = SlotWindow(key, size, slot.delay)
+            slot.concurrency = size
+            self.stats.max_value('adaptive_concurrency/max_window', size, spider=spider)
+        return window, slot
+
+    def _log(self, window, message, spider):
+        log.msg("Slot {0}: {1}".format(window.key, message), 
+                level=log.INFO if self.debug else log.DEBUG, spider=spider)
+
+    def _resize(self, window, slot, size, reason, spider):
+        size = min(max(size, self.min_size), self.max_size)
+        window.responses = 0
+        if size == window.size:
+            return
+        self.stats.inc_value('adaptive_concurrency/{0}'.format("increased" if size > window.size else "decreased"), 
+                             spider=spider)
+        self.stats.max_value('adaptive_concurrency/max_window', size, spider=spider)
+        self._log(window, "concurrency {0} -> {1} ({2})".format(window.size, size, reason), spider)
+        window.size = slot.concurrency = size
+
+    def _decrease(self, window, slot, reason, spider):
+        if window.grace > 0:
+            window.grace -= 1 # sent before the last decrease, says nothing new
+            return
+        self._resize(window, slot, window.size // 2, reason, spider)
+        window.grace = len(slot.transferring)
+
+    def _back_off(self, window, slot, delay, spider):
+        window.backoff_until = max(window.backoff_until, time.time() + delay)
+        if delay > slot.delay:
+            self.stats.inc_value('adaptive_concurrency/retry_after', spider=spider)
+            self._log(window, "holding requests back for {0:.1f}s (Retry-After)".format(delay), spider)
+            slot.delay = delay
+
+    def _set_crawl_delay(self, window, slot, delay, spider):
+        if delay <= window.base_delay:
+            return
+        self.stats.set_value('adaptive_concurrency/crawl_delay/{0}'.format(window.key), delay, spider=spider)
+        self._log(window, "download delay {0:.1f}s (robots.txt Crawl-delay)".format(delay), spider)
+        window.base_delay = delay
+        slot.delay = max(slot.delay, delay)
+
+    def process_response(self, request, response, spider):
+        window, slot = self._get_window(request, spider)
+        if window is None:
+            return response
+        status = response.status
+        if status == 429 or status >= 500:
+            self.stats.inc_value('adaptive_concurrency/{0}'.format("throttled" if status in (429, 503) else "errors"),
+                                 spider=spider)
+            self._decrease(window, slot, "HTTP {0}".format(status), spider)
+            retry_after = parse_retry_after(response.headers.get('Retry-After', ''))
+            if retry_after:
+                self._back_off(window, slot, min(retry_after, self.max_retry_after), spider)
+            return response
+        if window.grace > 0:
+            window.grace -= 1
+        if slot.delay > window.base_delay and time.time() >= window.backoff_until:
+            self._log(window, "Retry-After is over", spider)
+            slot.delay = window.base_delay
+        if status == 200 and urlparse_cached(request).path == '/robots.txt':
+            delay = parse_crawl_delay(response.body, self.user_agent)
+            if delay:
+                self._set_crawl_delay(window, slot, delay, spider)
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return response
+        if window.latency is None:
+            window.latency = latency
+        else:
+            window.latency += self.latency_weight * (latency - window.latency)
+        window.responses += 1
+        if window.responses >= window.size:
+            if window.latency <= self.target_latency:
+                self._resize(window, slot, window.size + 1, "latency {0:.2f}s".format(window.latency), spider)
+            elif window.latency > 2 * self.target_latency:
+                self._resize(window, slot, window.size - 1, "latency {0:.2f}s".format(window.latency), spider)
+            else:
+                window.responses = 0
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, IgnoreRequest):
+            return
+        window, slot = self._get_window(request, spider)
+        if window is None:
+            return
+        self.stats.inc_value('adaptive_concurrency/errors', spider=spider)
+        self._decrease(window, slot, exception.__class__.__name__, spider)
+
+
+class DownloadTimingMiddleware(object):
+    '''
+    Times the "download" stage: from handing a request to the 
+    downloader until its response or error comes back. Only active 
+    while stage timings are enabled (poe_scrape.py --timings).
+    '''
+
+    def __init__(self):
+        super(DownloadTimingMiddleware, self).__init__()
+        if not stage_timings.enabled:
+            raise NotConfigured
+
+    def process_request(self, request, spider):
+        request.meta['download_start_time'] = time.time()
+
+    def _record(self, request):
+        start = request.meta.pop('download_start_time', None)
+        if start is not None:
+            stage_timings.add("download", time.time() - start)
+
+    def process_response(self, request, response, spider):
+        self._record(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self._record(request)
+
+
+class ParseTimingMiddleware(object):
+    '''
+    Times the "parse" stage. Spider callbacks are generators, so the
+    time is taken for each item or request they produce, not for the
+    callback call itself.
+    '''
+
+    def __init__(self):
+        super(ParseTimingMiddleware, self).__init__()
+        if not stage_timings.enabled:
+            raise NotConfigured
+
+    def process_spider_output(self, response, result, spider):
+        results = iter(result)
+        while True:
+            with stage_timings.stage("parse"):
+                try:
+                    x = next(results)
+                except StopIteration:
+                    return
+            yield x
@@ -6,82 +6,421 @@
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
 import os, re, sys
+import codecs
+import itertools
+import bisect
+import multiprocessing
+from twisted.internet import reactor
 from scrapy import signals, log
-from scrapy.contrib.exporter import XmlItemExporter, PprintItemExporter
-import poe_scrape
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.project import data_path
 import time
-from lxml import html
-from lxml.cssselect import CSSSelector
+import cPickle as pickle
+import hashlib
+import sre_constants
+import sre_parse
+from collections import OrderedDict
+from scrapy_engine.items import SpecialItemDetails, SPECIAL_ITEM_MARKERS, is_special_item
+from scrapy_engine.database import UniquesDatabase
+from scrapy_engine.exporters import BatchedItemExporter
+from scrapy_engine.middlewares import UrlFilterMiddleware
+from scrapy_engine.timings import stage_timings
 
 
-def _get_category(spider):
-    '''List_of_unique_boots -> Boots'''
-    path = spider.path
-    if not path.startswith("List_of_unique"):
-        return "Invalid Category"
-    last_underscore = path.rfind("_")
-    return path[last_underscore+1:].capitalize()
+_WORDS_RE = re.compile(r'([a-zA-Z]+)')
+_SPACES_RE = re.compile(" {2,}")
+_VARIANT_NAME_RE = re.compile(r"([A-Za-z]+) variant.*")
+_TIMESTAMP_RE = re.compile(r"auto-generated by poe_scrape\.py on [0-9T:-]+")
+
+# Part of the transforms signature. Bump it on any change to how mods and
+# lines are rendered that the rules don't show, e.g. in _format_value or
+# _render_category, so persisted TransformCaches and CategoryStores are dropped.
+OUTPUT_FORMAT_VERSION = 1
 
 
 def _get_words(text):
-    return re.findall(r'([a-zA-Z]+)', text)
+    return _WORDS_RE.findall(text)
 
 
 def _get_memory_address(obj):
     return format(id(obj), '#010x' if sys.maxsize.bit_length() <= 32 else '#018x')
 
 
+_BACKREF_RE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def _compile_pattern(pattern, flags=0):
+    if pattern is None or hasattr(pattern, 'pattern'): # None or already compiled
+        return pattern
+    return re.compile(pattern, flags)
+
+
+class CompiledRule(object):
+    '''
+    A match rule with its patterns compiled once.
+    
+    ``exclude`` and ``include`` may each be given as a list of 
+    categories (resolved when building the dispatch table) or as 
+    a regex pattern (checked against the data on every call).
+    
+    Rules that replace a plain literal with a plain string carry 
+    both in ``literal`` and ``literal_replace`` so they can be run 
+    without the regex machinery, see LiteralRun.
+    '''
+    
+    __slots__ = ('name', 'pattern', 'replace', 'type', 'apply_at', 
+                 'exclude', 'exclude_re', 'include', 'include_re', 
+                 'literal', 'literal_replace')
+    
+    def __init__(self, rule):
+        super(CompiledRule, self).__init__()
+        self.name = rule.get('name', "Unnamed")
+        self.pattern = _compile_pattern(rule['match'], rule.get('options', 0))
+        self.replace = rule.get('replace', None)
+        rule_type = rule.get('type', None)
+        self.type = "-".join(rule_type) if rule_type is not None else None
+        self.apply_at = rule.get('apply_at', None)
+        exclude = rule.get('exclude', None)
+        include = rule.get('include', None)
+        self.exclude = exclude if isinstance(exclude, list) else None
+        self.exclude_re = _compile_pattern(exclude) if isinstance(exclude, basestring) else None
+        self.include = include if isinstance(include, list) else None
+        self.include_re = _compile_pattern(include) if isinstance(include, basestring) else None
+        self.literal = None
+        self.literal_replace = None
+        replace = self.replace
+        if isinstance(replace, basestring) and "\\" not in replace:
+            literal = _literal_text(self.pattern)
+            try:
+                replace = unicode(replace)
+            except UnicodeDecodeError:
+                literal = None
+            if literal:
+                self.literal = literal
+                self.literal_replace = replace
+    
+    def __repr__(self):
+        return "<CompiledRule {0!r}>".format(self.name)
+    
+    def apply(self, data):
+        return self.pattern.sub(self.replace, data)
+
+
+def _literal_text(pattern):
+    '''The string matched by the compiled ``pattern`` or None if it isn't a plain literal.'''
+    if pattern.flags & re.IGNORECASE:
+        return None
+    chars = []
+    for op, av in sre_parse.parse(pattern.pattern, pattern.flags):
+        if op != sre_constants.LITERAL:
+            return None
+        chars.append(unichr(av))
+    return u"".join(chars) or None
+
+
+def _overlaps(left, right):
+    '''True if a non-empty suffix of ``left`` is a prefix of ``right``.'''
+    for size in xrange(1, min(len(left), len(right)) + 1):
+        if left.endswith(right[:size]):
+            return True
+    return False
+
+
+def compile_rules(match_rules):
+    '''Compile a rule spec (or list of rule specs) into CompiledRules.'''
+    if not isinstance(match_rules, list):
+        match_rules = [match_rules]
+    return [CompiledRule(rule) for rule in match_rules]
+
+
+def _required_literals(pattern):
+    '''
+    Literals that must occur in any text matched by the compiled ``pattern``. 
+    
+    Returns a list of alternatives tuples: for each tuple at least one of 
+    its strings must be a substring of the text. Only mandatory parts of 
+    the pattern are looked at, so the result may be incomplete but never 
+    wrong. Case insensitive patterns get no literals.
+    '''
+    if pattern.flags & re.IGNORECASE:
+        return []
+    def collect(parsed):
+        literals = []
+        run = []
+        for op, av in parsed:
+            if op == sre_constants.LITERAL:
+                run.append(unichr(av))
+                continue
+            if run:
+                literals.append((u"".join(run),))
+                run = []
+            if op == sre_constants.IN and all(o == sre_constants.LITERAL for o, _ in av):
+                literals.append(tuple(unichr(v) for _, v in av))
+            elif op == sre_constants.SUBPATTERN:
+                literals.extend(collect(av[1]))
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+                literals.extend(collect(av[2]))
+        if run:
+            literals.append((u"".join(run),))
+        return literals
+    return collect(sre_parse.parse(pattern.pattern, pattern.flags))
+
+
+class CombinedRuleMatcher(object):
+    '''
+    Finds the first rule (in rule order) whose pattern matches anywhere 
+    in a text, as trying ``rule.pattern.search`` one rule after another 
+    would, but with a single combined alternation ``(?P<r0>...)|(?P<r1>...)``.
+    
+    Rules whose required literals are missing from the text are left out 
+    of the alternation up front. The leftmost match of the alternation 
+    only wins if no rule of higher precedence matches further right, 
+    which is checked with the alternation of just those rules.
+    '''
+    
+    def __init__(self, rules):
+        super(CombinedRuleMatcher, self).__init__()
+        self.rules = rules
+        self.literals = [_required_literals(rule.pattern) for rule in rules]
+        self.flags = rules[0].pattern.flags
+        self._patterns = {}
+    
+    @classmethod
+    def from_dispatch(cls, dispatched):
+        '''Matcher for a DataTransform.rules_for() entry or None if the rules can't be combined.'''
+        rules = []
+        for rule, exclude_re, include_re in dispatched:
+            if exclude_re is not None or include_re is not None:
+                return None # data dependent filters need the per rule loop
+            if rules and rule.pattern.flags != rules[0].pattern.flags:
+                return None
+            if _BACKREF_RE.search(rule.pattern.pattern):
+                return None # group numbers shift inside the combined pattern
+            rules.append(rule)
+        if not rules:
+            return None
+        return cls(rules)
+    
+    def _candidates(self, text):
+        mask = 0
+        for i, literals in enumerate(self.literals):
+            for alternatives in literals:
+                for literal in alternatives:
+                    if literal in text:
+                        break
+                else:
+                    break
+            else:
+                mask |= 1 << i
+        return mask
+    
+    def _pattern(self, mask):
+        try:
+            return self._patterns[mask]
+        except KeyError:
+            pass
+        branches = []
+        groups = {}
+        group_index = 1
+        for i, rule in enumerate(self.rules):
+            if not mask & (1 << i):
+                continue
+            name = "r{0}".format(i)
+            branches.append(u"(?P<{0}>{1})".format(name, rule.pattern.pattern))
+            groups[name] = (i, group_index, rule.pattern.groups)
+            group_index = group_index + 1 + rule.pattern.groups
+        combined = self._patterns[mask] = (re.compile(u"|".join(branches), self.flags), groups)
+        return combined
+    
+    def match(self, text):
+        '''Return (rule, match groups of that rule) for the winning rule or None.'''
+        mask = self._candidates(text)
+        winner = None
+        pos = 0
+        while mask:
+            pattern, groups = self._pattern(mask)
+            match = pattern.search(text, pos)
+            if match is None:
+                break
+            index, group_index, num_groups = groups[match.lastgroup]
+            winner = (self.rules[index], match.groups()[group_index:group_index + num_groups])
+            mask = mask & ((1 << index) - 1)
+            pos = match.start() + 1
+        return winner
+
+
+class LiteralRun(object):
+    '''
+    Consecutive literal-only rules applied in one pass over the data: one 
+    alternation of all literals with a lookup for the replacement.
+    
+    That is only done when it gives the same result as applying the rules 
+    one after another: 
+    
+    - literals must not overlap each other.
+    - a replacement must not contain the literal of a later rule and 
+      must not form one together with the text in front of it.
+    - a replacement may form the literal of a later rule together with 
+      the text after it, like "To to" -> "To" followed by "To of" -> "Of" 
+      on "To to of". The run then also matches the combined literal 
+      ("To to of" -> "Of").
+    
+    Otherwise the rules are applied one after another with 
+    ``unicode.replace``, which is still cheaper than ``re.sub``.
+    
+    Note: single characters go into the alternation too. A translate table 
+    would be the obvious choice for those but ``unicode.translate`` with a 
+    mapping is slower than the regex on Python 2.
+    '''
+    
+    def __init__(self, rules):
+        super(LiteralRun, self).__init__()
+        self.rules = rules
+        self.name = " + ".join(rule.name for rule in rules)
+        self.pairs = [(rule.literal, rule.literal_replace) for rule in rules]
+        self.matcher = None
+        self.lookup = self._build_lookup(self.pairs)
+        if self.lookup is None:
+            log.msg("Not fusing '%s': rules depend on each other" % self.name, log.DEBUG)
+        elif len(self.lookup) > 1:
+            # longest first so combined literals win over their parts
+            literals = sorted(self.lookup, key=len, reverse=True)
+            self.matcher = re.compile(u"|".join(re.escape(literal) for literal in literals), re.UNICODE)
+    
+    def __repr__(self):
+        return "<LiteralRun {0!r}>".format(self.name)
+    
+    @staticmethod
+    def _build_lookup(pairs):
+        lookup = {}
+        for i, (literal, replacement) in enumerate(pairs):
+            for other, _ in pairs:
+                if literal != other and (other in literal or _overlaps(literal, other)):
+                    return None
+            for later, later_replacement in pairs[i+1:]:
+                if later in replacement or _overlaps(later, replacement):
+                    return None
+                sizes = [size for size in xrange(1, min(len(replacement), len(later) - 1) + 1)
+                         if replacement.endswith(later[:size])]
+                if len(sizes) > 1:
+                    return None
+                for size in sizes:
+                    combined = literal + later[size:]
+                    combined_replacement = replacement[:-size] + later_replacement
+                    for other, _ in pairs:
+                        if other in combined_replacement or _overlaps(combined_replacement, other):
+                            return None
+                    lookup.setdefault(combined, combined_replacement)
+            lookup.setdefault(literal, replacement)
+        return lookup
+    
+    def _replace_match(self, match):
+        return self.lookup[match.group(0)]
+    
+    def apply(self, data):
+        if not isinstance(data, unicode):
+            # keep re.sub semantics for byte strings
+            for rule in self.rules:
+                data = rule.apply(data)
+            return data
+        matcher = self.matcher
+        if matcher is not None:
+            # most lines have nothing to replace, searching first is cheaper than sub
+            if matcher.search(data) is None:
+                return data
+            return matcher.sub(self._replace_match, data)
+        for literal, replacement in self.pairs:
+            data = data.replace(literal, replacement)
+        return data
+
+
 class DataTransform(object):
     
+    # run consecutive literal-only rules through a LiteralRun
+    fuse_literals = True
+    
     def __init__(self, match_rules, processor):
         self.match_rules = match_rules
         self.processor = processor
+        self.rules = compile_rules(match_rules)
+        self._dispatch = {}
     
     def is_transformed(self, data):
         return (self.processor.value_separator in data)
     
     def apply_match_rule(self, rule, data):
-        return re.sub(rule['match'], 
-                      rule['replace'], data, rule.get('options', re.UNICODE))
+        return rule.apply(data)
+    
+    def _select_rules(self, category, step):
+        selected = []
+        for rule in self.rules:
+            if category and rule.exclude is not None and category in rule.exclude:
+                log.msg("Excluding rule '%s' for category %s" %  
+                        (rule.name, category), log.DEBUG)
+                continue
+            if step and rule.apply_at is None:
+                log.msg("Skipping '%s' at step %s: step given but 'apply_at' missing" %  
+                        (rule.name, step), log.DEBUG)
+                continue
+            elif step and step != rule.apply_at:
+                log.msg("Skipping '%s' at step %s: current step different from 'apply_at'" %  
+                        (rule.name, step), log.DEBUG)
+                continue
+            if category and rule.include is not None and category not in rule.include:
+                log.msg("Skipping rule '%s': category %s not in 'include'" %  
+                        (rule.name, category), log.DEBUG)
+                continue
+            if rule.replace is None:
+                continue
+            # data dependent filters are only honoured when a category is given
+            if category:
+                selected.append((rule, rule.exclude_re, rule.include_re))
+            else:
+                selected.append((rule, None, None))
+        if self.fuse_literals:
+            selected = self._fuse_literal_rules(selected)
+        return tuple(selected)
+    
+    def _fuse_literal_rules(self, selected):
+        fused = []
+        run = []
+        for entry in selected + [(None, None, None)]:
+            rule, exclude_re, include_re = entry
+            if rule is not None and rule.literal is not None \
+               and exclude_re is None and include_re is None:
+                run.append(rule)
+                continue
+            if run:
+                fused.append((LiteralRun(run), None, None))
+                run = []
+            if rule is not None:
+                fused.append(entry)
+        return fused
+    
+    def rules_for(self, category=None, step=None):
+        '''
+        Return the dispatch table entry for ``(category, step)``: 
+        the rules that apply, in order, each paired with its 
+        data dependent exclude and include patterns.
+        '''
+        key = (category, step)
+        try:
+            return self._dispatch[key]
+        except KeyError:
+            rules = self._dispatch[key] = self._select_rules(category, step)
+            return rules
         
     def transform(self, data, category=None, step=None):
-        match_rules = self.match_rules
-        if not isinstance(match_rules, list):
-            match_rules = [match_rules]
-        for rule in match_rules:
-            rule_name = rule.get('name', "Unnamed")
-            exclude = rule.get('exclude', None)
-            if category and exclude is not None:
-                if isinstance(exclude, list) and category in exclude:
-                    log.msg("Excluding rule '%s' for category %s" %  
-                            (rule['name'], category), log.DEBUG)
-                    continue
-                elif isinstance(exclude, str) and re.search(exclude, data):
-                    log.msg("Excluding rule '%s' for data %s" %  
-                            (rule_name, data), log.DEBUG)
-                    continue
-            apply_at = rule.get("apply_at", None)
-            if step and apply_at is not None:
-                if step != apply_at:
-                    log.msg("Skipping '%s' for data %s: current step different from 'apply_at'" %  
-                            (rule_name, data), log.DEBUG)
-                    continue
-            elif step:
-                log.msg("Skipping '%s' for data %s: step given but 'apply_at' missing" %  
-                        (rule_name, data), log.DEBUG)
+        for rule, exclude_re, include_re in self.rules_for(category, step):
+            if exclude_re is not None and exclude_re.search(data):
+                log.msg("Excluding rule '%s' for data %s" %  
+                        (rule.name, data), log.DEBUG)
                 continue
-            include = rule.get('include', None)
-            if category and include is not None:
-                if isinstance(include, list) and category not in include:
-                    log.msg("Skipping rule '%s': category %s not in 'include'" %  
-                            (rule_name, category), log.DEBUG)
-                    continue
-                elif isinstance(include, str) and re.search(include, data) is None:
-                    log.msg("Skipping rule '%s': data %s not matched by 'include'" %  
-                            (rule_name, category), log.DEBUG)
-                    continue
-            if rule.get('replace', None) is not None:
-                data = self.apply_match_rule(rule, data)
+            if include_re is not None and include_re.search(data) is None:
+                log.msg("Skipping rule '%s': data %s not matched by 'include'" %  
+                        (rule.name, data), log.DEBUG)
+                continue
+            data = self.apply_match_rule(rule, data)
         return data
 
 
@@ -96,7 +435,7 @@ class TextTransform(DataTransform):
         },
         { # em dash
             'name': 'Em dash -> minus',
-            'match': u"\2013",
+            'match': u"\u2013",
             'replace': "-"
         },
         {
@@ -107,14 +446,12 @@ class TextTransform(DataTransform):
         { # To to
             'name': 'To to -> To',
             'match': "To to",
-            'replace': "To",
-            'options': re.IGNORECASE
+            'replace': "To"
         },
         { # To of
             'name': 'To of -> Of',
             'match': "To of",
-            'replace': "Of",
-            'options': re.IGNORECASE
+            'replace': "Of"
         },
         { # Tabula Rasa
             'name': 'Tabula Rasa > Tabula Rasa|Always has 6-Link but no stats',
@@ -151,6 +488,8 @@ class SanitizeTransform(DataTransform):
 
 class ValueTransform(DataTransform):
     
+    fuse_literals = False
+    
     # Please note: sequential order of match rules is important
     number_formats = [
         { # Skill grants and gem supports
@@ -198,51 +537,257 @@ class ValueTransform(DataTransform):
     def __init__(self, processor):
         _match_rules = ValueTransform.number_formats
         super(ValueTransform, self).__init__(_match_rules, processor)
-        
+        self._matchers = {}
+    
+    def _format_value(self, rule, match_groups):
+        value = u"{0}".format(match_groups[0])
+        rule_type = rule.type
+        if len(match_groups) == 4:
+            if rule_type == "range-double-negative": 
+                value = u"-({0}-{1},{2}-{3})".format(match_groups[0], match_groups[1], 
+                                                     match_groups[2], match_groups[3])
+            else: # range-double-positive
+                value = u"{0}-{1},{2}-{3}".format(match_groups[0], match_groups[1], 
+                                                  match_groups[2], match_groups[3])
+        elif len(match_groups) == 2:
+            if rule_type == "range-single-negative":
+                value = u"-({0}-{1})".format(match_groups[0], 
+                                             match_groups[1])
+            else: # range-single-positive
+                value = u"{0}-{1}".format(match_groups[0], 
+                                          match_groups[1])
+        else:
+            log.msg("can't apply rule {0!r} - match groups missing".format(rule.name), log.DEBUG)
+        return value
+    
+    def _apply_matched_rule(self, rule, match_groups, text):
+        # XXX: this section is a bit of a hack: ideally we want the 'replace' spec 
+        # of the rule to cover the complete transform. However, in order to 
+        # forego dozens of regex variations for dealing with how the value is 
+        # embedded into the surrouding affix text, we simply take the match groups,
+        # matching the numeric values and alphanumeric text fragments covering the
+        # text portion of the affix line and string together the proper order that
+        # we need. I am not happy with this solution but for now it will have to do
+        # since I don't feel like writing a complete parser.
+        if rule.type is None:
+            text = rule.pattern.sub(rule.replace, text)
+            text = _SPACES_RE.sub(" ", text) # normalize 2 or more spaces into 1 space
+        else:
+            value = self._format_value(rule, match_groups)
+            # remove matched value from text before we extract just the words
+            text = rule.pattern.sub("", text)
+            words = _get_words(text)
+            text = u"{0}:{1}".format(value, u" ".join(words))
+        return text
+    
     # Override
     def apply_match_rule(self, rule, text):
-        number_match = re.search(rule['match'], text)
+        number_match = rule.pattern.search(text)
         if number_match:
-            # XXX: this section is a bit of a hack: ideally we want the 'replace' spec 
-            # of the rule to cover the complete transform. However, in order to 
-            # forego dozens of regex variations for dealing with how the value is 
-            # embedded into the surrouding affix text, we simply take the match groups,
-            # matching the numeric values and alphanumeric text fragments covering the
-            # text portion of the affix line and string together the proper order that
-            # we need. I am not happy with this solution but for now it will have to do
-            # since I don't feel like writing a complete parser.
             if not self.is_transformed(text): # don't process already processed lines again
-                rule_type = rule.get("type", None)
-                if rule_type is None:
-                    text = re.sub(rule["match"], rule["replace"], text)
-                    text = re.sub(" {2,}", " ", text) # normalize 2 or more spaces into 1 space
-                else:
-                    rule_type = "-".join(rule_type)
-                    match_groups = number_match.groups()
-                    value = "{0}".format(match_groups[0])
-                    if len(match_groups) == 4:
-                        if rule_type == "range-double-negative": 
-                            value = "-({0}-{1},{2}-{3})".format(match_groups[0], match_groups[1], 
-                                                                match_groups[2], match_groups[3])
-                        else: # range-double-positive
-                            value = "{0}-{1},{2}-{3}".format(match_groups[0], match_groups[1], 
-                                                             match_groups[2], match_groups[3])
-                    elif len(match_groups) == 2:
-                        if rule_type == "range-single-negative":
-                            value = "-({0}-{1})".format(match_groups[0], 
-                                                        match_groups[1])
-                        else: # range-single-positive
-                            value = "{0}-{1}".format(match_groups[0], 
-                                                     match_groups[1])
-                    else:
-                        log.msg("can't apply rule {0!r} - match groups missing".format(rule), log.DEBUG)
-                    # remove matched value from text before we extract just the words
-                    text = re.sub(rule['match'], "", text) 
-                    words = _get_words(text)
-                    text = "{0}:{1}".format(value, " ".join(words))
+                text = self._apply_matched_rule(rule, number_match.groups(), text)
         return text
+    
+    # Override
+    def transform(self, data, category=None, step=None):
+        rules = self.rules_for(category, step)
+        if not rules or self.is_transformed(data): # don't process already processed lines again
+            return data
+        try:
+            matcher = self._matchers[rules]
+        except KeyError:
+            matcher = self._matchers[rules] = CombinedRuleMatcher.from_dispatch(rules)
+        if matcher is None:
+            return super(ValueTransform, self).transform(data, category, step)
+        winner = matcher.match(data)
+        if winner is None:
+            return data
+        rule, match_groups = winner
+        return self._apply_matched_rule(rule, match_groups, data)
         
 
+class TransformCache(object):
+    '''
+    Bounded LRU memo for UniqueItemsProcessor._apply_transform,
+    keyed on (raw mod text, category).
+    
+    The cache can be saved to and loaded from disk. A saved cache
+    carries the signature of the transforms that filled it and is 
+    ignored on load if the rules or OUTPUT_FORMAT_VERSION have changed
+    since.
+    '''
+    
+    missing = object()
+    
+    def __init__(self, maxsize=4096, signature=None):
+        super(TransformCache, self).__init__()
+        self.maxsize = maxsize
+        self.signature = signature
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hit_rate = (100.0 * self.hits / lookups) if lookups > 0 else 0.0
+        return ("{} hits, {} misses ({:.1f}% hit rate), {}/{} entries"
+                .format(self.hits, self.misses, hit_rate, 
+                        len(self.entries), self.maxsize))
+    
+    def get(self, key):
+        entries = self.entries
+        try:
+            value = entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return self.missing
+        entries[key] = value # re-insert as most recently used
+        self.hits += 1
+        return value
+    
+    def put(self, key, value):
+        entries = self.entries
+        if key in entries:
+            del entries[key]
+        elif len(entries) >= self.maxsize:
+            entries.popitem(last=False)
+        entries[key] = value
+    
+    def load(self, path):
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'rb') as f:
+                signature, items = pickle.load(f)
+        except Exception as e:
+            log.msg("Ignoring unreadable transform cache {0}: {1}".format(path, e), log.WARNING)
+            return False
+        if signature != self.signature:
+            log.msg("Ignoring transform cache {0}: transform rules changed".format(path), log.INFO)
+            return False
+        for key, value in items[-self.maxsize:]:
+            self.entries[key] = value
+        log.msg("Loaded {0} entries from transform cache {1}".format(len(self.entries), path), log.DEBUG)
+        return True
+    
+    def save(self, path):
+        outdir = os.path.dirname(path)
+        if outdir and not os.path.exists(outdir):
+            os.makedirs(outdir)
+        with open(path, 'wb') as f:
+            pickle.dump((self.signature, self.entries.items()), f, pickle.HIGHEST_PROTOCOL)
+
+
+def _get_transforms_signature(transforms):
+    '''
+    Hash over the rules of all transforms and OUTPUT_FORMAT_VERSION, used
+    to validate a persisted TransformCache or CategoryStore.
+    '''
+    digest = hashlib.sha1()
+    digest.update(repr(OUTPUT_FORMAT_VERSION))
+    for transform in transforms:
+        digest.update(type(transform).__name__)
+        for rule in transform.rules:
+            replace = rule.replace
+            if callable(replace):
+                replace = replace.__code__.co_code
+            digest.update(repr((rule.name, rule.pattern.pattern, rule.pattern.flags, replace, 
+                                rule.type, rule.apply_at, rule.exclude, rule.include)))
+    return digest.hexdigest()
+
+
+class CategoryStore(object):
+    '''
+    Rendered Uniques.txt blocks of previous runs, keyed on category.
+    
+    Each block is stored with a hash over the items it was rendered 
+    from, see UniqueItemsProcessor._get_category_hash. process_all 
+    splices in the blocks whose hash still matches and only renders 
+    categories that changed. Like TransformCache it carries the 
+    transforms signature and is ignored on load if the rules or the 
+    OUTPUT_FORMAT_VERSION changed.
+    '''
+    
+    def __init__(self, signature=None):
+        super(CategoryStore, self).__init__()
+        self.signature = signature
+        self.entries = {}
+        self.reused = 0
+        self.rendered = 0
+    
+    def __str__(self):
+        return ("{} categories reused, {} rendered, {} stored"
+                .format(self.reused, self.rendered, len(self.entries)))
+    
+    def get(self, category, input_hash):
+        entry = self.entries.get(category)
+        if entry is None or entry[0] != input_hash:
+            self.rendered += 1
+            return None
+        self.reused += 1
+        return entry[1]
+    
+    def put(self, category, input_hash, lines):
+        self.entries[category] = (input_hash, lines)
+    
+    def load(self, path):
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'rb') as f:
+                signature, entries = pickle.load(f)
+        except Exception as e:
+            log.msg("Ignoring unreadable category store {0}: {1}".format(path, e), log.WARNING)
+            return False
+        if signature != self.signature:
+            log.msg("Ignoring category store {0}: transform rules changed".format(path), log.INFO)
+            return False
+        self.entries.update(entries)
+        log.msg("Loaded {0} categories from category store {1}".format(len(self.entries), path), log.DEBUG)
+        return True
+    
+    def save(self, path):
+        outdir = os.path.dirname(path)
+        if outdir and not os.path.exists(outdir):
+            os.makedirs(outdir)
+        with open(path, 'wb') as f:
+            pickle.dump((self.signature, self.entries), f, pickle.HIGHEST_PROTOCOL)
+
+
+class UniqueItemRecord(object):
+    '''
+    What UniqueItemsProcessor keeps of a UniqueItem. Fields are read 
+    as attributes or, like on the item, by key.
+    '''
+    
+    __slots__ = ('name', 'url', 'implicit_mods', 'affix_mods', 'category', 'list_path')
+    
+    def __init__(self, name, url, implicit_mods, affix_mods, category, list_path=None):
+        self.name = name
+        self.url = url
+        self.implicit_mods = implicit_mods
+        self.affix_mods = affix_mods
+        self.category = category
+        self.list_path = list_path
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+    
+    def __repr__(self):
+        return "<UniqueItemRecord {0} ({1})>".format(self.name, self.category)
+    
+    @classmethod
+    def from_item(cls, item):
+        return cls(item["name"], item["url"], item["implicit_mods"], item["affix_mods"],
+                   item["category"], item.get("list_path"))
+
+
 class UniqueItemsProcessor(object):
     
     file_header = """\
@@ -259,11 +804,13 @@ class UniqueItemsProcessor(object):
     
     def __init__(self):
         super(UniqueItemsProcessor, self).__init__()
-        self.text_store = ""
+        self.lines = []
+        self.line_slots = {}
         self.item_store = {}
+        self.item_names = {}
         self.categories = []
-        self.unique_items = []
         self.special_items = []
+        self.special_item_details = {}
         self.outdir = os.curdir
         self.spider = None
         self.transforms = [
@@ -272,13 +819,20 @@ class UniqueItemsProcessor(object):
             SanitizeTransform(self)
         ]
         self.append_item_url = False
+        self.transform_cache = None
+        self.transform_cache_file = None
+        self.category_store = None
+        self.category_store_file = None
+        self.render_workers = 0
+        self.formats = ['txt']
+        self.database_digest = None
+        self.debug = 0
     
     def __str__(self):
-        return ("<{} at {}> - {} items: {}/{}/{} (U/S/C)"
-                .format("UniqueItemsProcessor", 
-                        _get_memory_address(self), 
-                        self._item_count(), 
-                        len(self.unique_items), 
+        return ("<{} at {}> - items: {}/{}/{} (U/S/C)"
+                .format("UniqueItemsProcessor",
+                        _get_memory_address(self),
+                        self._item_count(),
                         len(self.special_items), 
                         len(self.categories)))
     
@@ -294,71 +848,140 @@ class UniqueItemsProcessor(object):
         return total
     
     def _get_unique_item_set(self, category):
-        unique_item_set = []
-        if category in self.item_store:
-            unique_item_set = self.item_store[category]
-        else:
-            self.item_store[category] = unique_item_set
+        '''Records of category, ordered by name.'''
+        unique_item_set = self.item_store.get(category)
+        if unique_item_set is None:
+            unique_item_set = self.item_store[category] = []
+            self.item_names[category] = []
         return unique_item_set
 
     @classmethod
     def is_special_item(cls, item):
-        # xpath for special mods
-        # .//*[@id='mw-content-text']/dl
-        affix_mods = item['affix_mods']
-        for affix_mod in affix_mods:
-            if ("<Style Variant>" in affix_mod) or ("see notes" in affix_mod):
-                return True
-        implicit_mods = item['implicit_mods']
-        for implicit_mod in implicit_mods:
-            if ("<Style Variant>" in implicit_mod) or ("see notes" in implicit_mod):
-                return True
-        return False
+        return is_special_item(item)
         
     def set_outdir(self, outdir):
         self.outdir = outdir
     
+    def reset(self):
+        '''Forget the items and lines of the last run, keep transforms and caches for the next.'''
+        self.lines = []
+        self.line_slots = {}
+        self.item_store = {}
+        self.item_names = {}
+        self.categories = []
+        self.special_items = []
+        self.special_item_details = {}
+    
+    def sort_by_list_paths(self, list_paths):
+        '''
+        Put categories in the order of ``list_paths`` (see
+        GamepediaSpider.get_list_paths), and items of the same name within
+        a category too, independent of the order in which concurrent
+        responses arrived.
+        '''
+        rank = dict((list_path, i) for i, list_path in enumerate(list_paths))
+        last = len(rank)
+        item_rank = lambda record: rank.get(record.list_path, last)
+        category_rank = {}
+        for category, unique_item_set in self.item_store.iteritems():
+            # records are ordered by name on insert, this only orders equal names
+            unique_item_set.sort(key=lambda record: (record.name, item_rank(record)))
+            if unique_item_set:
+                category_rank[category] = min(item_rank(record) for record in unique_item_set)
+        self.categories.sort(key=lambda category: category_rank.get(category, last))
+    
     def _add_category(self, category):
         if category not in self.categories:
             log.msg("Start new category {}".format(category), log.DEBUG)
             self.categories.append(category)
     
     def add_special_item(self, item):
+        '''Mark item, preferably the record add_unique_item returned for it, for process_special_items.'''
         category = item['category']
         self._add_category(category)
-        if poe_scrape.DEBUG > 0:
+        if self.debug > 0:
             log.msg("Marking {0} as special item for post-processing".format(item['name']), log.INFO)
         self.special_items.append(item)
         log.msg("Category {} with {} items total"
                 .format(category, self._item_count(category)), log.DEBUG)
+    
+    def add_special_item_details(self, details):
+        '''Store the mods scraped from a special item's own page for process_special_items.'''
+        self.special_item_details[(details['category'], details['name'])] = details
         
     def add_unique_item(self, item):
-        category = item['category']
+        '''Store item as a UniqueItemRecord in its category, ordered by name, and return the record.'''
+        record = UniqueItemRecord.from_item(item)
+        category = record.category
         self._add_category(category)
-        self.unique_items.append(item)
         unique_item_set = self._get_unique_item_set(category)
-        name = item["name"]
-        url = item["url"]
-        implicit_mods = item["implicit_mods"]
-        affix_mods = item["affix_mods"]
-        log.msg("Adding {0} to {1}".format(name, category), log.DEBUG)
-        unique_item_set.append({
-            "name": name, 
-            "url": url, 
-            "implicit_mods": implicit_mods, 
-            "affix_mods": affix_mods,
-            "category": category
-        })
-        unique_item_set = sorted(unique_item_set)
+        names = self.item_names[category]
+        log.msg("Adding {0} to {1}".format(record.name, category), log.DEBUG)
+        i = bisect.bisect_right(names, record.name)
+        names.insert(i, record.name)
+        unique_item_set.insert(i, record)
         log.msg("Category {} with {} items total"
-                .format(category, self._item_count(category)), log.DEBUG)
+                .format(category, len(unique_item_set)), log.DEBUG)
+        return record
 
+    def set_transform_cache(self, maxsize, path=None):
+        '''Memoize _apply_transform in an LRU cache of maxsize entries (0 disables it).
+           If path is given the cache is loaded from there and saved back after the run.
+        '''
+        if maxsize <= 0:
+            self.transform_cache = None
+            self.transform_cache_file = None
+            return
+        self.transform_cache = TransformCache(maxsize, _get_transforms_signature(self.transforms))
+        self.transform_cache_file = path
+        if path:
+            self.transform_cache.load(path)
+    
+    def set_category_store(self, path=None):
+        '''Reuse the rendered blocks of unchanged categories from the 
+           CategoryStore at path and save the store back after the run.
+        '''
+        if not path:
+            self.category_store = None
+            self.category_store_file = None
+            return
+        self.category_store = CategoryStore(_get_transforms_signature(self.transforms))
+        self.category_store_file = path
+        self.category_store.load(path)
+    
+    def _get_category_hash(self, category):
+        '''Hash over everything the rendered block of category depends on, see CategoryStore.'''
+        digest = hashlib.sha1()
+        digest.update(repr((self.append_item_url, os.linesep)))
+        for item in self._get_unique_item_set(category):
+            digest.update(repr((item["name"], item["url"], item["implicit_mods"], item["affix_mods"])))
+        for special_item in self.special_items:
+            if special_item['category'] != category:
+                continue
+            details = self.special_item_details.get((category, special_item['name']))
+            if details is not None:
+                details = (details['variants'], details['mods'])
+            digest.update(repr((special_item['name'], details)))
+        return digest.hexdigest()
+    
     def _apply_transform(self, data, category):
+        cache = self.transform_cache
+        if cache is None:
+            return self._transform(data, category)
+        key = (data, category)
+        result = cache.get(key)
+        if result is TransformCache.missing:
+            result = self._transform(data, category)
+            cache.put(key, result)
+        return result
+    
+    def _transform(self, data, category):
         # Internal: RegExr x-forms:
         #  *\+?(-)?\((-?[0-9\.]+) to (-?[0-9\.]+)\)%? *([\w ]+) -> $1$2-$3:$4
+        if isinstance(data, str):
+            data = data.decode(self.spider.get_site_encoding())
         for transform in self.transforms:
-            data = data.strip().decode(self.spider.get_site_encoding()) 
-            data = transform.transform(data, category)
+            data = transform.transform(data.strip(), category)
         return data
     
     def _process_name(self, item):
@@ -395,182 +1018,426 @@ class UniqueItemsProcessor(object):
             processed_mods.append(self._apply_transform(mod, category))
         return sep + sep.join(processed_mods)
     
+    def _write_lines(self, outfile, lines, encoding):
+        site_encoding = self.spider.get_site_encoding()
+        with codecs.open(outfile, 'w+b', encoding) as f:
+            for line in lines:
+                f.write(line if isinstance(line, unicode) else line.decode(site_encoding))
+    
     def _write_category(self, category, encoding="utf-8-sig"):
-        with open(os.path.join(self.outdir, category + ".txt"), 'w+b') as f:
-            f.write(self.text_store.decode(self.spider.get_site_encoding())
-                    .encode(encoding))
+        self._write_lines(os.path.join(self.outdir, category + ".txt"), self.lines, encoding)
 
     def _write_all(self, filename="Uniques.txt", encoding="utf-8-sig"):
+        '''
+        Write the header and lines to filename. The file is written aside 
+        and renamed over the old one, so readers never see it half written, 
+        and left alone if nothing but the header timestamp would change.
+        Returns whether the file was replaced.
+        '''
         outfile = os.path.join(self.outdir, filename)
-        with open(outfile, 'w+b') as f:
-            if self.text_store.strip() == self.file_header:
-                log.msg("Nothing to write. All URLs dropped by in/exclude patterns?")
-            else:
-                log.msg("Writing data to {0}.".format(outfile), level=log.INFO)
-                timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
-            f.write("{}{}".format(UniqueItemsProcessor.file_header.format(timestamp, os.linesep), self.text_store)
-                          .decode(self.spider.get_site_encoding()).encode(encoding))
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+        if len(self.lines) == 0:
+            log.msg("Nothing to write. All URLs dropped by in/exclude patterns?")
+        header = UniqueItemsProcessor.file_header.format(timestamp, os.linesep)
+        tmpfile = "{0}.tmp".format(outfile)
+        self._write_lines(tmpfile, itertools.chain([header], self.lines), encoding)
+        if self._has_same_content(outfile, tmpfile):
+            os.remove(tmpfile)
+            log.msg("{0} is unchanged.".format(outfile), level=log.INFO)
+            return False
+        log.msg("Writing data to {0}.".format(outfile), level=log.INFO)
+        if os.name == 'nt' and os.path.exists(outfile):
+            os.remove(outfile) # rename doesn't replace files on Windows
+        os.rename(tmpfile, outfile)
+        return True
     
-    def process_special_items(self):
-        log.msg("Parsing special items...", log.INFO)
+    @staticmethod
+    def _has_same_content(path, other_path):
+        '''Whether the files are equal apart from the timestamp in file_header.'''
+        if not os.path.exists(path):
+            return False
+        if os.path.getsize(path) != os.path.getsize(other_path):
+            return False
+        with open(path, 'rb') as f:
+            content = f.read()
+        with open(other_path, 'rb') as f:
+            other_content = f.read()
+        return _TIMESTAMP_RE.sub("", content, 1) == _TIMESTAMP_RE.sub("", other_content, 1)
+    
+    def _get_database_items(self):
+        '''Items in output order with their transformed mods, see UniquesDatabase.write.'''
+        encoding = self.spider.get_site_encoding()
+        to_unicode = lambda text: text if isinstance(text, unicode) else text.decode(encoding)
+        is_mod = lambda mod: (mod and mod.strip() and 
+                              not any(marker in mod for marker in SPECIAL_ITEM_MARKERS))
+        for category in self.categories:
+            for record in self._get_unique_item_set(category):
+                mods = []
+                for implicit, item_mods in ((True, record.implicit_mods), (False, record.affix_mods)):
+                    mods.extend((implicit, None, to_unicode(self._apply_transform(mod, category)))
+                                for mod in item_mods if is_mod(mod))
+                details = self.special_item_details.get((category, record.name))
+                if details is not None:
+                    if details['variants'] is not None:
+                        variants = [(_VARIANT_NAME_RE.sub(r"\1", variant_name).strip(), variant_mods) 
+                                    for variant_name, variant_mods in details['variants']]
+                    else:
+                        variants = [(None, details['mods'])]
+                    for variant, variant_mods in variants:
+                        variant = to_unicode(variant) if variant else None
+                        mods.extend((False, variant, to_unicode(self._apply_transform(mod, category)))
+                                    for mod in variant_mods if is_mod(mod))
+                yield (to_unicode(record.name), to_unicode(category), to_unicode(record.url), mods)
+    
+    def _write_database(self, filename="Uniques.sqlite"):
+        if not os.path.exists(self.outdir):
+            os.makedirs(self.outdir)
+        path = os.path.join(self.outdir, filename)
+        items = list(self._get_database_items())
+        digest = hashlib.sha1(repr(items)).hexdigest()
+        if digest == self.database_digest and os.path.exists(path):
+            log.msg("{0} is unchanged.".format(path), level=log.INFO)
+            return
+        num_items, num_mods, has_fts = UniquesDatabase(path).write(items)
+        self.database_digest = digest
+        log.msg("Wrote {0} items with {1} mods to {2}.".format(num_items, num_mods, path), level=log.INFO)
+        if not has_fts:
+            log.msg("SQLite has no FTS4, queries on {0} fall back to LIKE".format(path), level=log.WARNING)
+    
+    def _process_special_item(self, special_item, details):
         sep = self.field_separator
-        for special_item in self.special_items:
-            url = special_item['url']
-            category = special_item['category']
-            name = special_item['name']
-            doc = html.parse(url)
-            base_sel = "div#mw-content-text.mw-content-ltr > ul"
-            variant_names = doc.xpath(CSSSelector('{} li'.format(base_sel)).path)
-            variant_mods_dl = doc.xpath(CSSSelector('{}+dl'.format(base_sel)).path)
-            if len(variant_names) == len(variant_mods_dl):
-                mod_string = ""
-                initial_sep = ""
-                for variant_name, dl in zip(variant_names, variant_mods_dl):
-                    processed_mods = []
-                    mods = dl.xpath('.//span')
-                    for _mod in mods:
-                        mod = _mod.text
-                        if len(mod.strip()) == 0:
-                            continue
-                        processed_mods.append(self._apply_transform(mod, category))
-                    var_name = re.sub(r"([A-Za-z]+) variant.*", r"\1", variant_name.text)
-                    mod_string = mod_string + "{} -{}- {}{}".format(initial_sep, 
-                                                                    var_name.strip(), 
-                                                                    sep, sep.join(processed_mods))
-                    initial_sep = sep
-            else:
+        category = special_item['category']
+        name = special_item['name']
+        mod_string = None
+        if details['variants'] is not None:
+            mod_string = ""
+            initial_sep = ""
+            for variant_name, mods in details['variants']:
                 processed_mods = []
-                text_mods = doc.xpath('.//dl//dd/span')
-                for _mod in text_mods:
-                    mod = _mod.text
-                    if len(mod.strip()) == 0:
+                for mod in mods:
+                    if not mod or len(mod.strip()) == 0:
                         continue
                     processed_mods.append(self._apply_transform(mod, category))
-                    mod_string = " {} ".format(name) + sep.join(processed_mods)
+                var_name = _VARIANT_NAME_RE.sub(r"\1", variant_name)
+                mod_string = mod_string + "{} -{}- {}{}".format(initial_sep, 
+                                                                var_name.strip(), 
+                                                                sep, sep.join(processed_mods))
+                initial_sep = sep
+        else:
+            processed_mods = []
+            for mod in details['mods']:
+                if not mod or len(mod.strip()) == 0:
+                    continue
+                processed_mods.append(self._apply_transform(mod, category))
+            if processed_mods:
+                mod_string = " {} ".format(name) + sep.join(processed_mods)
+        return mod_string
+    
+    def process_special_items(self):
+        log.msg("Processing special items...", log.INFO)
+        for special_item in self.special_items:
+            name = special_item['name']
+            if (special_item['category'], name) not in self.line_slots:
+                continue # category was spliced in from the CategoryStore
+            details = self.special_item_details.get((special_item['category'], name))
+            if details is None:
+                log.msg("No details for special item {0} ({1}), keeping it as is"
+                        .format(name, special_item['url']), log.WARNING)
+                continue
+            mod_string = self._process_special_item(special_item, details)
+            if mod_string is None:
+                log.msg("No mods found for special item {0} ({1}), keeping it as is"
+                        .format(name, special_item['url']), log.WARNING)
+                continue
             pattern = "<Style Variant>"
-            lines = []
-            for line in self.text_store.split(os.linesep):
-                if name in line:
-                    lines.append(line.replace(pattern, mod_string))
-                else:
-                    lines.append(line)
-            self.text_store = os.linesep.join(lines)
+            lines = self.lines
+            for slot in self.line_slots.get((special_item['category'], name), ()):
+                lines[slot] = lines[slot].replace(pattern, mod_string)
             
-    def post_process_text_store(self):
-        for transform in self.transforms:
-            self.text_store = transform.transform(self.text_store, step="post_process")
+    def post_process_lines(self, spans=None):
+        '''Post-process the lines in the (start, end) ranges of spans, all lines by default.'''
+        step = "post_process"
+        transforms = [transform for transform in self.transforms 
+                      if transform.rules_for(step=step)]
+        if not transforms:
+            return
+        lines = self.lines
+        if spans is None:
+            spans = [(0, len(lines))]
+        for start, end in spans:
+            for i in xrange(start, end):
+                line = lines[i]
+                for transform in transforms:
+                    line = transform.transform(line, step=step)
+                lines[i] = line
         
-    def process_all(self):
-        for category in self.categories:
-            unique_item_set = self._get_unique_item_set(category)
-            text = self.text_store
-            text = text + (self.category_header.format(category, self._item_count(category)))
+    def _render_category(self, category):
+        '''Return the lines of category's block and the line slots of its items,
+           relative to the start of the block. See process_special_items.
+        '''
+        lines = []
+        slots = {}
+        unique_item_set = self._get_unique_item_set(category)
+        lines.append(self.category_header.format(category, self._item_count(category)))
+        if self.append_item_url:
+            line_format = "{{}}{{}}{{}} ; {{}} {0}".format(os.linesep)
+        else:
+            line_format = "{{}}{{}}{{}}{0}".format(os.linesep)
+        for item in unique_item_set:
+            slots.setdefault((item['category'], item['name']), []).append(len(lines))
+            fields = [self._process_name(item),
+                      self._process_implicit_mods(item), 
+                      self._process_affix_mods(item)]
             if self.append_item_url:
-                line_format = "{{}}{{}}{{}} ; {{}} {0}".format(os.linesep)
-                for item in unique_item_set:
-                    line = line_format.format(self._process_name(item),
-                                              self._process_implicit_mods(item), 
-                                              self._process_affix_mods(item),
-                                              item["url"])
-                    text = text + line
-            else:
-                line_format = "{{}}{{}}{{}}{0}".format(os.linesep)
-                for item in unique_item_set:
-                    line = line_format.format(self._process_name(item),
-                                              self._process_implicit_mods(item), 
-                                              self._process_affix_mods(item))
-                    text = text + line
-            self.text_store = text
-            #self._write_category(category)
-        self.process_special_items()
-        self.post_process_text_store()
-        self._write_all()
+                fields.append(item["url"])
+            lines.append(line_format.format(*fields))
+        return lines, slots
+    
+    def _append_block(self, block, slots):
+        '''Append a block from _render_category to self.lines, return its (start, end).'''
+        start = len(self.lines)
+        line_slots = self.line_slots
+        for key, offsets in slots.iteritems():
+            line_slots.setdefault(key, []).extend(start + offset for offset in offsets)
+        self.lines.extend(block)
+        return start, len(self.lines)
+    
+    def _render_categories(self, categories):
+        '''
+        Render categories, return a dict of category -> (lines, slots).
+        
+        With render_workers > 1 the categories are spread over a pool of 
+        that many processes. The workers are forked with a copy of this 
+        processor, so only category names go out and rendered blocks come 
+        back. Transforms are deterministic, the blocks are the same as 
+        in serial mode.
+        '''
+        workers = min(self.render_workers, len(categories))
+        if workers < 2 or not hasattr(os, 'fork'):
+            return dict((category, self._render_category(category)) for category in categories)
+        global _g_render_processor
+        _g_render_processor = self
+        pool = multiprocessing.Pool(workers)
+        try:
+            blocks = pool.map(_render_category_worker, categories, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            _g_render_processor = None
+        return dict(zip(categories, blocks))
+    
+    def process_all(self):
+        '''Write the outputs in self.formats, "txt" for Uniques.txt and "sqlite" for Uniques.sqlite.'''
+        if "txt" in self.formats:
+            self._process_lines()
+        if "sqlite" in self.formats:
+            with stage_timings.stage("database"):
+                self._write_database()
+        self._finish_transform_cache()
+        self._finish_category_store()
+    
+    def _process_lines(self):
+        lines = self.lines
+        store = self.category_store
+        rendered = []
+        with stage_timings.stage("transform"):
+            stored = OrderedDict()
+            for category in self.categories:
+                input_hash = None
+                block = None
+                if store is not None:
+                    input_hash = self._get_category_hash(category)
+                    block = store.get(category, input_hash)
+                stored[category] = (input_hash, block)
+            blocks = self._render_categories([category for category, (_, block) in stored.iteritems() 
+                                              if block is None])
+            for category, (input_hash, block) in stored.iteritems():
+                if block is not None:
+                    lines.extend(block)
+                    continue
+                start, end = self._append_block(*blocks[category])
+                rendered.append((category, input_hash, start, end))
+                #self._write_category(category)
+        with stage_timings.stage("special_items"):
+            self.process_special_items()
+        with stage_timings.stage("post_process"):
+            self.post_process_lines([(start, end) for _, _, start, end in rendered])
+        if store is not None:
+            for category, input_hash, start, end in rendered:
+                store.put(category, input_hash, lines[start:end])
+        with stage_timings.stage("write"):
+            self._write_all()
+    
+    def _finish_category_store(self):
+        store = self.category_store
+        if store is None:
+            return
+        log.msg("Category store: {0}".format(store), log.INFO)
+        try:
+            store.save(self.category_store_file)
+        except (IOError, OSError) as e:
+            log.msg("Could not save category store to {0}: {1}"
+                    .format(self.category_store_file, e), log.WARNING)
+    
+    def _finish_transform_cache(self):
+        cache = self.transform_cache
+        if cache is None:
+            return
+        log.msg("Transform cache: {0}".format(cache), log.INFO)
+        if self.transform_cache_file:
+            try:
+                cache.save(self.transform_cache_file)
+            except (IOError, OSError) as e:
+                log.msg("Could not save transform cache to {0}: {1}"
+                        .format(self.transform_cache_file, e), log.WARNING)
 
 
 _g_unique_items_processor = UniqueItemsProcessor()
 
+# processor whose categories the forked workers render, see _render_categories
+_g_render_processor = None
+
+
+def _render_category_worker(category):
+    return _g_render_processor._render_category(category)
+
 
 class PoeScrapyPipeline(object):
+    '''
+    Feeds the scraped items to a UniqueItemsProcessor and the item 
+    exports, and writes the outputs when the spider closes. A crawl
+    that is stopped before it finished writes nothing, the outputs of
+    the last complete one stay as they were.
+    
+    With WATCH_INTERVAL > 0 the spider never closes on its own. Each
+    time it runs idle, the outputs of the crawl so far are written and 
+    the start requests are scheduled again WATCH_INTERVAL seconds after 
+    the last cycle started. Crawler, connections, HTTP cache, processor 
+    transforms and caches all stay warm from one cycle to the next.
+    '''
     
     def __init__(self):
-        self.files = {}
-        self.exporters = {}
-        self.exporter_types = [
-            (XmlItemExporter, '.xml'), 
-            (PprintItemExporter, '.txt')
-        ]
+        self.exporter = None
+        self.crawler = None
+        self.watch_interval = 0
+        self.cycle = 1
+        self.cycle_started = time.time()
+        self.next_cycle = None
     
     @classmethod
     def from_crawler(cls, crawler):
         pipeline = cls()
+        pipeline.crawler = crawler
+        crawler.signals.connect(pipeline.spider_opened, signals.spider_opened)
         crawler.signals.connect(pipeline.spider_closed, signals.spider_closed)
-        pipeline.outdir = crawler.settings.get('OUTPATH', os.curdir)
-        pipeline.verbose = crawler.settings.get('VERBOSE', 0)
+        settings = crawler.settings
+        pipeline.watch_interval = settings.getfloat('WATCH_INTERVAL', 0)
+        if pipeline.watch_interval > 0:
+            crawler.signals.connect(pipeline.spider_idle, signals.spider_idle)
+        pipeline.outdir = settings.get('OUTPATH', os.curdir)
+        pipeline.verbose = settings.get('VERBOSE', 0)
+        pipeline.url_filter = UrlFilterMiddleware.from_crawler(crawler)
+        pipeline.exporter = BatchedItemExporter(pipeline.outdir,
+                                                settings.getlist('EXPORT_FORMATS'),
+                                                settings.getint('EXPORT_BATCH_SIZE', 100),
+                                                settings.getbool('EXPORT_THREADED', False))
         pipeline.processor = UniqueItemsProcessor()
-        pipeline.processor.append_item_url = crawler.settings.get('APPEND_ITEM_URL', False)
+        pipeline.processor.append_item_url = settings.get('APPEND_ITEM_URL', False)
+        pipeline.processor.debug = settings.getint('DEBUG', 0)
+        pipeline.processor.set_transform_cache(settings.getint('TRANSFORM_CACHE_SIZE', 4096),
+                                               settings.get('TRANSFORM_CACHE_FILE', None))
+        category_store_file = settings.get('CATEGORY_STORE_FILE', None)
+        if category_store_file:
+            category_store_file = data_path(category_store_file)
+        pipeline.processor.set_category_store(category_store_file)
+        pipeline.processor.render_workers = settings.getint('RENDER_WORKERS', 0)
+        pipeline.processor.formats = settings.getlist('UNIQUES_FORMATS', ['txt'])
         return pipeline
+    
+    def spider_opened(self, spider):
+        self.cycle_started = time.time()
+        list_paths = ()
+        if hasattr(spider, 'get_list_paths'):
+            list_paths = spider.get_list_paths(self.url_filter)
+        self.exporter.open(list_paths)
           
-    def spider_closed(self, spider):
-        for exporters in self.exporters.itervalues():
-            for exporter in exporters:
-                exporter.finish_exporting()
-        for afile in self.files.itervalues():
-            afile.close()
-        self.processor.set_outdir(self.outdir)
-        self.processor.process_all()
-
-    def _create_outfile(self, spider, outpath):
-        outfile = open(outpath, 'w+b')
-        filekey = self._get_file_key(spider, outpath)
-        self.files[filekey] = outfile
-        return outfile
-    
-    def _append_outline(self, item, filekey):
-        exporters = self.exporters[filekey]
-        for exporter in exporters:
-            if isinstance(item, list):
-                for entry in list:
-                    exporter.export_item(entry)
+    def spider_closed(self, spider, reason):
+        if self.watch_interval > 0:
+            if self.next_cycle is not None:
+                self.next_cycle.cancel()
+                self.next_cycle = None
             else:
-                exporter.export_item(item)
+                # keep the outputs of the last complete cycle
+                log.msg("Discarding unfinished watch cycle {0}".format(self.cycle), 
+                        level=log.WARNING, spider=spider)
+                self.exporter.abort()
+            return
+        if reason != 'finished':
+            # partial data, keep the outputs of the last complete crawl
+            log.msg("Crawl stopped ({0}), nothing written".format(reason),
+                    level=log.WARNING, spider=spider)
+            self.exporter.abort()
+            return
+        self._finish_crawl(spider)
     
-    def _get_outfile_path(self, spider, ext='.xml'):
-        '''Must be called from process_item only, 
-           otherwise spider.path will be None!
-        '''
-        outdir = self.outdir
-        try:
-            if not os.path.exists(outdir):
-                os.makedirs(os.path.join(os.curdir, outdir))
-            return os.path.join(outdir, "{0}{1}".format(spider.path, ext))
-        except:
-            return None
-            
-    def _get_file_key(self, spider, outpath):
-        return ("{0} -> {1}".format(spider, outpath))
+    def spider_idle(self, spider):
+        if self.next_cycle is None:
+            # idle fires again every few seconds while we wait, finish only once
+            try:
+                self._finish_crawl(spider)
+            except Exception:
+                log.err(None, "Watch cycle {0} failed".format(self.cycle), spider=spider)
+            elapsed = time.time() - self.cycle_started
+            delay = max(0, self.watch_interval - elapsed)
+            log.msg("Watch cycle {0} took {1:.1f}s, next one in {2:.1f}s"
+                    .format(self.cycle, elapsed, delay), level=log.INFO, spider=spider)
+            self.next_cycle = reactor.callLater(delay, self._start_cycle, spider)  # @UndefinedVariable
+        raise DontCloseSpider
+    
+    def _start_cycle(self, spider):
+        self.next_cycle = None
+        self.cycle += 1
+        log.msg("Starting watch cycle {0}".format(self.cycle), level=log.INFO, spider=spider)
+        self.processor.reset()
+        self.spider_opened(spider)
+        engine = self.crawler.engine
+        # the same pages as last cycle, which the dupefilter still remembers
+        dupefilter = engine.slot.scheduler.df
+        if hasattr(dupefilter, 'fingerprints'):
+            dupefilter.fingerprints.clear()
+        # through the spider middlewares like the first start requests (UrlFilterMiddleware)
+        dfd = engine.scraper.spidermw.process_start_requests(spider.start_requests(), spider)
+        dfd.addCallback(self._schedule_requests, spider)
+        dfd.addErrback(log.err, "Could not start watch cycle {0}".format(self.cycle), spider=spider)
+    
+    def _schedule_requests(self, requests, spider):
+        engine = self.crawler.engine
+        for request in requests:
+            engine.crawl(request, spider)
+        # the engine only looks again at the end of its idle wait, get it going now
+        engine.slot.nextcall()
+    
+    def _finish_crawl(self, spider):
+        self.exporter.close()
+        self.processor.spider = spider
+        if hasattr(spider, 'get_list_paths'):
+            self.processor.sort_by_list_paths(spider.get_list_paths())
+        self.processor.set_outdir(self.outdir)
+        self.processor.process_all()
+        if hasattr(spider, 'crawl_finished'):
+            spider.crawl_finished()
     
     def process_item(self, item, spider):
-        outpath = self._get_outfile_path(spider)
-        filekey = self._get_file_key(spider, outpath)
+        with stage_timings.stage("process_item"):
+            return self._process_item(item, spider)
+    
+    def _process_item(self, item, spider):
+        if isinstance(item, SpecialItemDetails):
+            self.processor.add_special_item_details(item)
+            return item
         self.processor.spider = spider
-        if filekey in self.files:
-            outfile = self.files[filekey]
-        else:
-            for etype in self.exporter_types:
-                exporter_t_cls = etype[0]
-                exporter_t_ext = etype[1]
-                outpath = self._get_outfile_path(spider, exporter_t_ext)
-                outfile = self._create_outfile(spider, outpath)
-                exporter = exporter_t_cls(outfile)
-                if filekey in self.exporters:
-                    existing = self.exporters[filekey]
-                    existing.append(exporter)
-                    self.exporters[filekey] = existing
-                else:    
-                    self.exporters[filekey] = [exporter]
-                exporter.start_exporting()
-        self._append_outline(item, filekey)
+        self.exporter.export_item(item)
+        record = self.processor.add_unique_item(item)
         if self.processor.is_special_item(item):
-            self.processor.add_special_item(item)
-        self.processor.add_unique_item(item)
+            self.processor.add_special_item(record)
         return item
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# Recent changes of the wiki, for crawling only what was edited since the last crawl
+#
+# Enabled with poe_scrape.py --changes, see the RECENT_CHANGES_* settings
+# See: https://www.mediawiki.org/wiki/API:RecentChanges
+
+import os
+import json
+from urllib import urlencode, unquote
+from urlparse import urlparse
+
+import scrapy
+from scrapy import log
+
+
+# edits, new pages and log entries (moves, deletions) of articles and templates
+_QUERY_PARAMS = (
+    ('action', 'query'),
+    ('list', 'recentchanges'),
+    ('rcprop', 'title|ids|timestamp'),
+    ('rcnamespace', '0|10'),
+    ('format', 'json'),
+    ('continue', ''),
+)
+
+_TEMPLATE_NAMESPACE = 10
+
+
+def get_title(url):
+    '''http://pathofexile.gamepedia.com/List_of_unique_fishing%20rods -> List of unique fishing rods'''
+    title = unquote(urlparse(url).path.lstrip("/")).decode('utf-8').replace(u"_", u" ").strip()
+    # MediaWiki titles start upper case, links may not
+    return title[:1].upper() + title[1:]
+
+
+class RecentChanges(object):
+    '''
+    Which wiki pages were edited since the last crawl, according to the
+    recent changes feed of the MediaWiki API.
+
+    The last change of the last complete crawl (its rcid and timestamp)
+    is kept in a small JSON state file, loaded with the first request.
+    make_request starts a new read of the feed from there, parse_response
+    collects the changed titles and returns the request for the next page
+    of the feed, if any. Once the crawl is done, commit moves the state on
+    to the newest change read.
+
+    Everything counts as changed when there is no state yet, when the
+    last change seen has dropped out of the feed (the wiki only keeps
+    recent changes for a while) or when a template was edited, as
+    templates may be part of any page.
+    '''
+
+    page_size = 500
+
+    def __init__(self, api_url, path=None):
+        super(RecentChanges, self).__init__()
+        self.api_url = api_url
+        self.path = path
+        self.rcid = None
+        self.timestamp = None
+        self.loaded = False
+        self._reset()
+
+    def __str__(self):
+        if self.titles is None:
+            return "all pages changed"
+        return "{0} pages changed since {1}".format(len(self.titles), self.timestamp)
+
+    def _reset(self):
+        self.titles = None
+        self.found_last = False
+        self.template_changed = False
+        self.newest = (self.rcid, self.timestamp)
+        self.failures = 0
+
+    def load(self):
+        self.loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.load(f)
+            self.rcid, self.timestamp = state['rcid'], state['timestamp']
+        except (ValueError, KeyError, IOError) as e:
+            log.msg("Ignoring unreadable recent changes state {0}: {1}".format(self.path, e), log.WARNING)
+            return False
+        self._reset()
+        log.msg("Last change seen: {0} at {1}".format(self.rcid, self.timestamp), log.DEBUG)
+        return True
+
+    def save(self):
+        if not self.path:
+            return
+        outdir = os.path.dirname(self.path)
+        if outdir and not os.path.exists(outdir):
+            os.makedirs(outdir)
+        tmppath = "{0}.tmp".format(self.path)
+        with open(tmppath, 'wb') as f:
+            json.dump({'rcid': self.rcid, 'timestamp': self.timestamp}, f)
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path) # rename doesn't replace files on Windows
+        os.rename(tmppath, self.path)
+
+    def make_request(self, callback, continue_params=None):
+        '''
+        Request for the changes since the last one seen, or just for the
+        newest change if there is no state yet. Without continue_params
+        this starts a new read of the feed.
+        '''
+        if not self.loaded:
+            self.load()
+        if continue_params is None:
+            self._reset()
+        params = list(_QUERY_PARAMS)
+        if self.rcid is None:
+            params.extend((('rcdir', 'older'), ('rclimit', '1')))
+        else:
+            params.extend((('rcdir', 'newer'), ('rcstart', self.timestamp),
+                           ('rclimit', str(self.page_size))))
+        if continue_params:
+            params.extend((key, unicode(value).encode('utf-8'))
+                          for key, value in sorted(continue_params.iteritems()))
+        return scrapy.Request("{0}?{1}".format(self.api_url, urlencode(params)),
+                              callback=callback,
+                              # answered by the wiki every time, never from the HTTP cache
+                              headers={'Cache-Control': 'no-store'},
+                              meta={'url_filtered': True},
+                              dont_filter=True)
+
+    def parse_response(self, response):
+        '''Collect the changes in response, return the request for more of them or None.'''
+        data = json.loads(response.body_as_unicode())
+        for change in data.get('query', {}).get('recentchanges', ()):
+            rcid = change.get('rcid')
+            if rcid is None:
+                continue
+            if rcid == self.rcid:
+                self.found_last = True
+            if self.rcid is not None and rcid <= self.rcid:
+                continue
+            if self.newest[0] is None or rcid > self.newest[0]:
+                self.newest = (rcid, change['timestamp'])
+            if self.titles is None:
+                self.titles = set()
+            self.titles.add(change['title'])
+            if change.get('ns') == _TEMPLATE_NAMESPACE:
+                self.template_changed = True
+        # without state only the newest change was asked for
+        if 'continue' in data and self.rcid is not None:
+            return self.make_request(response.request.callback, data['continue'])
+        if self.rcid is None:
+            log.msg("No recent changes state yet, crawling everything", log.INFO)
+            self.titles = None
+        elif not self.found_last:
+            log.msg("Last change seen ({0} at {1}) is no longer in the feed, crawling everything"
+                    .format(self.rcid, self.timestamp), log.INFO)
+            self.titles = None
+        elif self.template_changed:
+            log.msg("Templates changed, crawling everything", log.INFO)
+            self.titles = None
+        elif self.titles is None:
+            self.titles = set()
+        log.msg("Recent changes: {0}".format(self), log.INFO)
+        return None
+
+    def is_changed(self, url):
+        '''Whether the page at url may have changed since the last crawl.'''
+        return self.titles is None or get_title(url) in self.titles
+
+    def commit(self):
+        '''Remember the newest change read as seen, unless pages failed to download.'''
+        if self.failures:
+            log.msg("{0} pages failed, keeping the last change seen at {1} to fetch them again"
+                    .format(self.failures, self.timestamp), log.WARNING)
+            return
+        self.rcid, self.timestamp = self.newest
+        self.save()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+# Spiders and output formats known to poe_scrape.py
+#
+# Plain data only, so the command line can list and check them without
+# importing scrapy. Classes are given by their dotted path and loaded
+# once a crawl starts (see scrapy.utils.misc.load_object).
+
+from collections import OrderedDict
+
+
+SPIDERS = [{
+    'name': 'gamepedia',
+    'target_domain': 'http://pathofexile.gamepedia.com',
+    'class': 'scrapy_engine.spiders.gamepedia.GamepediaSpider'
+}, {
+    'name': 'gamepedia_api',
+    'target_domain': 'http://pathofexile.gamepedia.com/api.php',
+    'class': 'scrapy_engine.spiders.gamepedia_api.GamepediaApiSpider'
+}]
+
+# name -> (item exporter class, file extension), see BatchedItemExporter
+EXPORT_FORMATS = OrderedDict([
+    ('jsonlines', ('scrapy.contrib.exporter.JsonLinesItemExporter', '.jl')),
+    ('pickle', ('scrapy.contrib.exporter.PickleItemExporter', '.pickle')),
+    ('xml', ('scrapy.contrib.exporter.XmlItemExporter', '.xml')),
+    ('pprint', ('scrapy.contrib.exporter.PprintItemExporter', '.txt')),
+])
+
+# outputs of UniqueItemsProcessor.process_all, see the UNIQUES_FORMATS setting
+UNIQUES_FORMATS = ('txt', 'sqlite')
@@ -10,6 +10,9 @@
 
 BOT_NAME = 'scrapy_engine'
 
+# Debug level, set by poe_scrape.py from the DebugLevel environment variable
+DEBUG = 0
+
 SPIDER_MODULES = ['scrapy_engine.spiders']
 NEWSPIDER_MODULE = 'scrapy_engine.spiders'
 
@@ -17,13 +20,102 @@ ITEM_PIPELINES = {
     'scrapy_engine.pipelines.PoeScrapyPipeline': 300
 }
 
-CONCURRENT_REQUESTS_PER_DOMAIN = 4
-CONCURRENT_REQUESTS = 4
+# Applies the -i/-e URL patterns to start requests before they are downloaded
+SPIDER_MIDDLEWARES = {
+    'scrapy_engine.middlewares.UrlFilterMiddleware': 50,
+    # next to the spider, times its callbacks only (poe_scrape.py --timings)
+    'scrapy_engine.middlewares.ParseTimingMiddleware': 990
+}
+
+# Revalidates cached pages (If-None-Match/If-Modified-Since) instead of
+# downloading them again, see scrapy_engine.httpcache
+DOWNLOADER_MIDDLEWARES = {
+    'scrapy.contrib.downloadermiddleware.httpcache.HttpCacheMiddleware': None,
+    'scrapy_engine.middlewares.ReportingHttpCacheMiddleware': 900,
+    # right in front of the download, so robots.txt, redirects etc. are replayed too
+    'scrapy_engine.middlewares.ArchiveMiddleware': 800,
+    # sees every response and download error of the network before retries and caching
+    'scrapy_engine.middlewares.AdaptiveConcurrencyMiddleware': 950,
+    # next to the downloader, times the network only (poe_scrape.py --timings)
+    'scrapy_engine.middlewares.DownloadTimingMiddleware': 990
+}
+
+HTTPCACHE_ENABLED = True
+HTTPCACHE_POLICY = 'scrapy_engine.httpcache.RevalidatePolicy'
+HTTPCACHE_STORAGE = 'scrapy_engine.httpcache.CompressedCacheStorage'
+HTTPCACHE_DIR = 'httpcache'
+# Least recently used pages are evicted beyond this many (compressed) bytes, 0 for no limit
+HTTPCACHE_MAX_SIZE = 50 * 1024 * 1024
+
+# Record all responses to / replay them from this dir, see poe_scrape.py --record/--replay
+ARCHIVE_RECORD_DIR = None
+ARCHIVE_REPLAY_DIR = None
+
+# Safe to raise: category and output file travel with each item, not the spider.
+# Per domain, this is only where the adaptive concurrency starts out.
+CONCURRENT_REQUESTS_PER_DOMAIN = 8
+CONCURRENT_REQUESTS = 32
 CONCURRENT_ITEMS = 10
 ROBOTSTXT_OBEY = True
 
+# Grow/shrink the requests in flight per domain with its latency and error rate,
+# honouring Retry-After and robots.txt Crawl-delay (see AdaptiveConcurrencyMiddleware)
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_CONCURRENCY_MIN = 1
+ADAPTIVE_CONCURRENCY_MAX = 32
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 1.0
+ADAPTIVE_CONCURRENCY_MAX_RETRY_AFTER = 120
+ADAPTIVE_CONCURRENCY_DEBUG = False
+
+# Scrapy's defaults plus 429 Too Many Requests, retried after its Retry-After
+RETRY_HTTP_CODES = [500, 502, 503, 504, 400, 408, 429]
+
 # Append "; <item url>" as line terminating comment to Uniques.txt
 APPEND_ITEM_URL = True
 
+# Max. number of transformed mod lines kept in the LRU transform cache (0 disables it)
+TRANSFORM_CACHE_SIZE = 4096
+
+# Persist the transform cache here so repeated runs start warm (None disables it)
+TRANSFORM_CACHE_FILE = None
+
+# Rendered Uniques.txt blocks per category, unchanged categories are reused
+# from here on the next run (relative to the .scrapy dir, None disables it)
+CATEGORY_STORE_FILE = 'categories.pickle'
+
+# Item exports next to Uniques.txt, one file per unique item list and format: 
+# jsonlines (.jl), pickle (.pickle), xml (.xml) and pprint (.txt). Empty disables them.
+EXPORT_FORMATS = ['jsonlines']
+
+# Items buffered per list before they are handed to the item exporters
+EXPORT_BATCH_SIZE = 100
+
+# Write export batches from a separate thread instead of the reactor thread
+EXPORT_THREADED = False
+
+# Output of the unique items: Uniques.txt (txt) and/or Uniques.sqlite (sqlite), 
+# a database with items, mods, value ranges and a full-text index over the mods 
+# for poe_scrape.py query
+UNIQUES_FORMATS = ['txt']
+
+# Crawl again this many seconds after the last crawl started, in the same process,
+# until stopped (0 crawls once). See PoeScrapyPipeline and poe_scrape.py --watch
+WATCH_INTERVAL = 0
+
+# Processes rendering the Uniques.txt categories in parallel (0 or 1 renders serially)
+RENDER_WORKERS = 0
+
+# Read the wiki's recent changes first and only download the pages edited since
+# the last crawl, the others come from the HTTP cache (poe_scrape.py --changes)
+RECENT_CHANGES_ENABLED = False
+
+# Last change seen by a complete crawl (relative to the .scrapy dir)
+RECENT_CHANGES_STATE_FILE = 'recentchanges.json'
+
+# MediaWiki API endpoint (gamepedia_api spider and recent changes) and titles 
+# per request for the gamepedia_api spider
+GAMEPEDIA_API_URL = 'http://pathofexile.gamepedia.com/api.php'
+GAMEPEDIA_API_BATCH_SIZE = 50
+
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 #USER_AGENT = 'scrapy_engine (+http://www.yourdomain.com)'
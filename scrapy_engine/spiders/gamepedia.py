@@ -22,19 +22,81 @@ Implements scrapy.Spider for gamepedia.com
             |
 :contact:   | andre@irisvfx.com
 '''
-import re
 from urlparse import urlparse
 
+from w3lib.url import safe_url_string
+from lxml import etree, html
+from lxml.cssselect import CSSSelector
+
 import scrapy
-from scrapy import Selector, log
-from scrapy_engine.items import UniqueItem
+from scrapy import log
+from scrapy.utils.project import data_path
+from scrapy_engine.items import UniqueItem, SpecialItemDetails, is_special_item
+from scrapy_engine.middlewares import UrlFilterMiddleware
+from scrapy_engine.recentchanges import RecentChanges
+
+
+# selectors for the detail page of a special item, see parse_special_item
+_VARIANT_LIST = "div#mw-content-text.mw-content-ltr > ul"
+_VARIANT_NAMES = CSSSelector("{} li".format(_VARIANT_LIST))
+_VARIANT_MODS_DL = CSSSelector("{}+dl".format(_VARIANT_LIST))
+_VARIANT_MODS = etree.XPath(".//span")
+_TEXT_MODS = etree.XPath(".//dl//dd/span")
+
+# selectors for a row of a unique item list, see parse
+_ITEM_ROWS = etree.XPath(".//tr[@id]")
+_ITEM_LINK = etree.XPath("./td[1]/a[1]")
+_MOD_GROUP = "./td[last()]//div[@class='itemboxstatsgroup']"
+_NUM_MOD_SPANS = etree.XPath("count({}/span)".format(_MOD_GROUP))
+_IMPLICIT_MODS = etree.XPath("{}[1]//span/text()".format(_MOD_GROUP), smart_strings=False)
+_AFFIX_MODS = etree.XPath("{}[last()]//span/text()".format(_MOD_GROUP), smart_strings=False)
+
+_html_parsers = {}
+
+
+def _get_html_parser(encoding):
+    parser = _html_parsers.get(encoding)
+    if parser is None:
+        parser = _html_parsers[encoding] = html.HTMLParser(encoding=encoding)
+    return parser
+
+
+def get_list_path(url):
+    '''http://pathofexile.gamepedia.com/List_of_unique_boots -> List_of_unique_boots'''
+    doc_path = urlparse(url).path
+    if doc_path.startswith("/"):
+        doc_path = doc_path[1:]
+    return doc_path
+
+
+def get_category(list_path):
+    '''List_of_unique_boots -> Boots'''
+    if not list_path.startswith("List_of_unique"):
+        return "Invalid Category"
+    last_underscore = list_path.rfind("_")
+    return list_path[last_underscore+1:].capitalize()
 
 
 class GamepediaSpider(scrapy.Spider):
+    '''
+    Scrapes the unique item lists of the wiki, and the pages of special
+    items (see scrapy_engine.items.is_special_item) for their mods.
+    
+    With RECENT_CHANGES_ENABLED it first reads the wiki's recent changes 
+    (see RecentChanges) through the api.php at GAMEPEDIA_API_URL. Pages
+    that were not edited since the last crawl are then taken from the 
+    HTTP cache as they are, only the edited ones are downloaded.
+    '''
     
     name = 'gamepedia'
     allowed_domains = ['pathofexile.gamepedia.com']
     encoding = "utf-8"
+    api_url = 'http://pathofexile.gamepedia.com/api.php'
+    recent_changes = None
+    
+    def __init__(self, *args, **kwargs):
+        super(GamepediaSpider, self).__init__(*args, **kwargs)
+        self._reset_special_items()
     start_urls = [
         'http://pathofexile.gamepedia.com/List_of_unique_amulets',
         'http://pathofexile.gamepedia.com/List_of_unique_belts',
@@ -61,35 +123,79 @@ class GamepediaSpider(scrapy.Spider):
         'http://pathofexile.gamepedia.com/List_of_unique_maps'
     ]
 
-    def set_path(self, url_parts):
-        doc_path = url_parts.path
-        if doc_path.startswith("/"):
-            doc_path = doc_path[1:]
-        self.path = doc_path
-
+    def set_crawler(self, crawler):
+        super(GamepediaSpider, self).set_crawler(crawler)
+        settings = crawler.settings
+        self.api_url = settings.get('GAMEPEDIA_API_URL', self.api_url)
+        if settings.getbool('RECENT_CHANGES_ENABLED', False):
+            state_file = settings.get('RECENT_CHANGES_STATE_FILE', None)
+            if state_file:
+                state_file = data_path(state_file)
+            self.recent_changes = RecentChanges(self.api_url, state_file)
+    
     def get_site_encoding(self):
         return self.encoding
     
-    def get_category(self):
-        '''List_of_unique_boots -> Boots'''
-        path = self.path
-        if not path.startswith("List_of_unique"):
-            return "Invalid Category"
-        last_underscore = path.rfind("_")
-        return path[last_underscore+1:].capitalize()
-    
-    def _is_valid_url(self, url):
-        inpat = self._crawler.settings.get('INCLUDE_PATTERN', None)
-        expat = self._crawler.settings.get('EXCLUDE_PATTERN', None)
-        if expat and re.search(expat, url):
-            self.log("Dropping %s (reason: excluded by URL exclude pattern)" % url, level=log.INFO)
-            return False
-        if inpat and not re.search(inpat, url):
-            self.log("Dropping %s (reason: not included by URL include pattern)" % url, level=log.INFO)
-            return False
-        self.log("Processing %s" % url, level=log.INFO)
-        return True
-
+    def get_list_paths(self, url_filter=None):
+        '''
+        List paths of the start URLs in crawl order, so the pipeline can 
+        put categories back in order no matter which response came first.
+        With a UrlFilterMiddleware as url_filter, only those of the URLs 
+        it lets through.
+        '''
+        urls = (safe_url_string(url) for url in self.start_urls)
+        return [get_list_path(url) for url in urls 
+                if url_filter is None or url_filter.get_drop_reason(url) is None]
+    
+    def _reset_special_items(self):
+        # special item page requests and their details by URL, see request_special_item
+        self.special_item_requests = {}
+        self.special_item_details = {}
+    
+    def start_requests(self):
+        # also called for every watch cycle, which fetches the special items again
+        self._reset_special_items()
+        if self.recent_changes is not None and not self.crawler.settings.getbool('HTTPCACHE_ENABLED', False):
+            log.msg("Recent changes need the HTTP cache for the unchanged pages, crawling everything",
+                    level=log.WARNING, spider=self)
+            self.recent_changes = None
+        if self.recent_changes is None:
+            return super(GamepediaSpider, self).start_requests()
+        # the list pages follow once the changes are known
+        return [self.recent_changes.make_request(self.parse_recent_changes)]
+    
+    def parse_recent_changes(self, response):
+        next_request = self.recent_changes.parse_response(response)
+        if next_request is not None:
+            return [next_request]
+        # not start requests any more, so the URL filter is applied here
+        url_filter = UrlFilterMiddleware.from_crawler(self.crawler)
+        return [self.make_page_request(url, self.parse) 
+                for url in (safe_url_string(url) for url in self.start_urls)
+                if url_filter.is_valid_url(url, self)]
+    
+    def make_page_request(self, url, callback, meta=None, dont_filter=True):
+        '''
+        Request for the page at url. With recent changes, a page that wasn't 
+        edited since the last crawl is marked ``unchanged`` for RevalidatePolicy 
+        to answer it from the HTTP cache.
+        '''
+        request = scrapy.Request(url, callback=callback, meta=meta, dont_filter=dont_filter)
+        if self.recent_changes is not None:
+            request.meta['unchanged'] = not self.recent_changes.is_changed(url)
+            request.errback = self.page_failed
+        return request
+    
+    def page_failed(self, failure):
+        '''Count the failure against committing the recent changes, Scrapy logs it as usual.'''
+        self.recent_changes.failures += 1
+        return failure
+    
+    def crawl_finished(self):
+        '''Called by PoeScrapyPipeline once the outputs of a complete crawl are written.'''
+        if self.recent_changes is not None:
+            self.recent_changes.commit()
+    
     def parse(self, response):
         """
         The lines below is a spider contract. For more info see:
@@ -97,27 +203,90 @@ class GamepediaSpider(scrapy.Spider):
         @url http://pathofexile.gamepedia.com/List_of_unique_XXX
         @scrapes pathofexile.gamepedia.com
         """
-        if not self._is_valid_url(response.url):
-            return None
         url_parts = urlparse(response.url)
-        self.set_path(url_parts)
-        #self.log('A response from %s just arrived!' % response.url)
-        sel = Selector(response)        
-        items = sel.xpath(".//tr[@id]")
-        unique_items = []
-        for an_item in items: 
+        # derive everything from the response, parse runs for many pages concurrently
+        list_path = get_list_path(response.url)
+        url_prefix = "{}://{}".format(url_parts.scheme, url_parts.netloc)
+        doc = html.fromstring(response.body, base_url=response.url, 
+                              parser=_get_html_parser(response.encoding))
+        for unique_item in self.extract_unique_items(doc, list_path, url_prefix):
+            yield unique_item
+            if is_special_item(unique_item):
+                # mods are on the item's own page, fetch it along with the list pages
+                for request_or_details in self.request_special_item(unique_item):
+                    yield request_or_details
+    
+    def request_special_item(self, unique_item):
+        '''
+        The request for the page of a special item, once per URL for all
+        the lists the item is on. Further list items are added to the 
+        pending request, or get their details right away if the page was
+        already parsed.
+        '''
+        url = unique_item['url']
+        details = self.special_item_details.get(url)
+        if details is not None:
+            other = SpecialItemDetails(details)
+            other['name'] = unique_item['name']
+            other['category'] = unique_item['category']
+            return [other]
+        request = self.special_item_requests.get(url)
+        if request is not None:
+            request.meta['unique_items'].append(unique_item)
+            return []
+        request = self.make_page_request(url, self.parse_special_item, 
+                                         meta={'unique_items': [unique_item]}, dont_filter=False)
+        self.special_item_requests[url] = request
+        return [request]
+    
+    def extract_unique_items(self, doc, list_path, url_prefix):
+        '''
+        Yield a UniqueItem for every row of the unique item list in ``doc``.
+        Item URLs are the row's link appended to ``url_prefix``.
+        '''
+        category = get_category(list_path)
+        for row in _ITEM_ROWS(doc):
+            link = _ITEM_LINK(row)[0]
             unique_item = UniqueItem()
-            unique_item['name'] = an_item.xpath("./td[1]/a[1]/@title").extract()[0]
-            num_spans = len(an_item.xpath("./td[last()]//div[@class='itemboxstatsgroup']/span"))
-            if num_spans == 1:
+            unique_item['name'] = unicode(link.get("title"))
+            if _NUM_MOD_SPANS(row) == 1:
                 unique_item['implicit_mods'] = []
             else:
-                unique_item['implicit_mods'] = an_item.xpath("./td[last()]//div[@class='itemboxstatsgroup'][1]//span/text()").extract()
-            affix_mods = an_item.xpath("./td[last()]//div[@class='itemboxstatsgroup'][last()]//span/text()").extract()                
-            unique_item['affix_mods'] = affix_mods
-            unique_item['url'] = "{}://{}{}".format(url_parts.scheme, 
-                                                    url_parts.netloc, an_item.xpath("./td[1]/a[1]/@href").extract()[0])
-            unique_item['category'] = self.get_category()
-            unique_items.append(unique_item)
-        return unique_items
-    
\ No newline at end of file
+                unique_item['implicit_mods'] = [unicode(mod) for mod in _IMPLICIT_MODS(row)]
+            unique_item['affix_mods'] = [unicode(mod) for mod in _AFFIX_MODS(row)]
+            unique_item['url'] = "{}{}".format(url_prefix, link.get("href"))
+            unique_item['category'] = category
+            unique_item['list_path'] = list_path
+            yield unique_item
+    
+    def parse_special_item(self, response):
+        '''
+        Scrape variant names and mods from the detail page of a 
+        special item (see scrapy_engine.items.is_special_item), 
+        for every list the item is on.
+        '''
+        doc = html.fromstring(response.body, base_url=response.url, 
+                              parser=_get_html_parser(response.encoding))
+        unique_items = response.meta['unique_items']
+        all_details = [self.extract_special_item_details(doc, unique_item) for unique_item in unique_items]
+        url = unique_items[0]['url']
+        self.special_item_requests.pop(url, None)
+        self.special_item_details[url] = all_details[0]
+        return all_details
+    
+    def extract_special_item_details(self, doc, unique_item):
+        '''SpecialItemDetails for ``unique_item`` from its detail page ``doc``.'''
+        details = SpecialItemDetails()
+        details['name'] = unique_item['name']
+        details['url'] = unique_item['url']
+        details['category'] = unique_item['category']
+        details['variants'] = None
+        details['mods'] = None
+        variant_names = _VARIANT_NAMES(doc)
+        variant_mods_dl = _VARIANT_MODS_DL(doc)
+        if len(variant_names) == len(variant_mods_dl):
+            details['variants'] = [(variant_name.text, [span.text for span in _VARIANT_MODS(dl)])
+                                   for variant_name, dl in zip(variant_names, variant_mods_dl)]
+        else:
+            details['mods'] = [span.text for span in _TEXT_MODS(doc)]
+        return details
@@ -0,0 +1,176 @@
+# encoding: utf-8
+'''
+scrapy_engine.spiders.gamepedia_api -- API spider for pathofexile.gamepedia.com
+
+Implements scrapy.Spider for the MediaWiki API (api.php) of gamepedia.com
+
+:author:    | André Berg
+            |
+:copyright: | 2015 Iris VFX. All rights reserved.
+            |
+:license:   | Licensed under the Apache License, Version 2.0 (the "License");
+            | you may not use this file except in compliance with the License.
+            | You may obtain a copy of the License at
+            |
+            | http://www.apache.org/licenses/LICENSE-2.0
+            |
+            | Unless required by applicable law or agreed to in writing, software
+            | distributed under the License is distributed on an **"AS IS"** **BASIS**,
+            | **WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND**, either express or implied.
+            | See the License for the specific language governing permissions and
+            | limitations under the License.
+            |
+:contact:   | andre@irisvfx.com
+'''
+import json
+from urllib import urlencode, unquote
+from urlparse import urlparse
+
+from w3lib.url import safe_url_string
+from lxml import html
+
+import scrapy
+from scrapy import log
+from scrapy_engine.items import is_special_item
+from scrapy_engine.middlewares import UrlFilterMiddleware
+from scrapy_engine.spiders.gamepedia import GamepediaSpider, get_list_path
+
+
+# parsed content of the latest revision of each title, and nothing else
+_QUERY_PARAMS = (
+    ('action', 'query'),
+    ('prop', 'revisions'),
+    ('rvprop', 'content'),
+    ('rvparse', '1'),
+    ('redirects', '1'),
+    ('format', 'json'),
+    ('continue', ''),
+)
+
+# parsed content comes without the page chrome, GamepediaSpider's selectors expect this
+_CONTENT_WRAPPER = u'<div id="mw-content-text" class="mw-content-ltr">{}</div>'
+
+
+def _batches(sequence, size):
+    for i in xrange(0, len(sequence), size):
+        yield sequence[i:i+size]
+
+
+class GamepediaApiSpider(GamepediaSpider):
+    '''
+    Scrapes the same unique item lists as GamepediaSpider, but through
+    the wiki's api.php instead of the rendered pages.
+
+    List pages and special item pages are fetched in batches of up to
+    GAMEPEDIA_API_BATCH_SIZE titles per action=query request, which only
+    returns the parsed page content. Set GAMEPEDIA_API_URL to use another
+    endpoint, e.g. a local server replaying recorded API responses.
+    '''
+
+    name = 'gamepedia_api'
+    batch_size = 50
+
+    def set_crawler(self, crawler):
+        super(GamepediaApiSpider, self).set_crawler(crawler)
+        settings = crawler.settings
+        self.batch_size = settings.getint('GAMEPEDIA_API_BATCH_SIZE', self.batch_size)
+
+    def get_url_prefix(self):
+        '''Item URLs are relative to the API's host, just like on the rendered pages.'''
+        url_parts = urlparse(self.api_url)
+        return "{}://{}".format(url_parts.scheme, url_parts.netloc)
+
+    def start_requests(self):
+        if self.recent_changes is not None:
+            # batches mix changed and unchanged titles, their responses are cached as a whole
+            log.msg("Recent changes are not supported by the {0} spider, crawling everything"
+                    .format(self.name), level=log.WARNING, spider=self)
+            self.recent_changes = None
+        # batched requests carry many titles, so the URL filter is applied per title here
+        url_filter = UrlFilterMiddleware.from_crawler(self.crawler)
+        list_urls = [url for url in (safe_url_string(url) for url in self.start_urls)
+                     if url_filter.is_valid_url(url, self)]
+        for batch in _batches(list_urls, self.batch_size):
+            pages = {}
+            for url in batch:
+                list_path = get_list_path(url)
+                pages[unquote(list_path).decode('utf-8')] = list_path
+            yield self.make_api_request(pages, self.parse)
+
+    def make_api_request(self, pages, callback, continue_params=None, done=None):
+        '''
+        Request the parsed content of all titles in ``pages``, a dict
+        mapping each title to what ``callback`` needs for that page
+        (list path or the UniqueItems listed under that title).
+        '''
+        params = list(_QUERY_PARAMS)
+        params.append(('titles', u"|".join(sorted(pages)).encode('utf-8')))
+        if continue_params:
+            params.extend((key, unicode(value).encode('utf-8'))
+                          for key, value in sorted(continue_params.iteritems()))
+        return scrapy.Request("{}?{}".format(self.api_url, urlencode(params)),
+                              callback=callback,
+                              meta={'pages': pages, 'done': done or set(), 'url_filtered': True},
+                              dont_filter=True)
+
+    def parse_api_response(self, response):
+        '''
+        Return ``(pages, next_request)``: (value, content) pairs for every
+        page in the response, where value is what was passed for the page's
+        title to make_api_request, and the request continuing the query
+        if the API did not return all pages at once (or None).
+        '''
+        data = json.loads(response.body_as_unicode())
+        query = data.get('query', {})
+        requested = response.meta['pages']
+        done = response.meta['done']
+        # map normalized and redirect target titles back to the requested ones
+        aliases = {}
+        for key in ('normalized', 'redirects'):
+            for entry in query.get(key, ()):
+                aliases[entry['to']] = aliases.get(entry['from'], entry['from'])
+        pages = []
+        for page in query.get('pages', {}).itervalues():
+            title = aliases.get(page['title'], page['title'])
+            if 'missing' in page:
+                log.msg("Page {} not found".format(title.encode('utf-8')),
+                        level=log.WARNING, spider=self)
+                continue
+            revisions = page.get('revisions')
+            if not revisions or title not in requested or title in done:
+                continue
+            done.add(title)
+            pages.append((requested[title], revisions[0]['*']))
+        next_request = None
+        if 'continue' in data:
+            next_request = self.make_api_request(requested, response.request.callback,
+                                                 data['continue'], done)
+        return pages, next_request
+
+    def parse(self, response):
+        pages, next_request = self.parse_api_response(response)
+        url_prefix = self.get_url_prefix()
+        special_items = {}
+        for list_path, content in pages:
+            doc = html.fromstring(_CONTENT_WRAPPER.format(content))
+            for unique_item in self.extract_unique_items(doc, list_path, url_prefix):
+                yield unique_item
+                if is_special_item(unique_item):
+                    # one page for the item, details for every list it is on
+                    special_items.setdefault(unique_item['name'], []).append(unique_item)
+        if next_request is not None:
+            yield next_request
+        # mods are on the item's own page, fetch them in batches too
+        titles = sorted(special_items)
+        for batch in _batches(titles, self.batch_size):
+            yield self.make_api_request(dict((title, special_items[title]) for title in batch),
+                                        self.parse_special_item)
+
+    def parse_special_item(self, response):
+        pages, next_request = self.parse_api_response(response)
+        for unique_items, content in pages:
+            doc = html.fromstring(_CONTENT_WRAPPER.format(content))
+            for unique_item in unique_items:
+                yield self.extract_special_item_details(doc, unique_item)
+        if next_request is not None:
+            yield next_request
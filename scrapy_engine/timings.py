@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# Per-stage wall/CPU timings, see poe_scrape.py --timings/--profile
+#
+# Stages are timed where they run: downloads and spider callbacks by the
+# timing middlewares, the rest by the pipeline and UniqueItemsProcessor.
+
+import os
+import time
+import cProfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class StageStats(object):
+
+    __slots__ = ('name', 'calls', 'wall', 'cpu', 'profile')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = None
+        self.profile = None
+
+
+class StageTimings(object):
+    '''
+    Accumulates wall and CPU time per named stage.
+
+    Disabled by default, stage() then costs next to nothing. If enabled
+    with a profile_dir, each stage also gets its own cProfile.Profile,
+    dumped to <profile_dir>/<stage>.pstats by save_profiles. Stages
+    don't nest, a stage started while another one runs is timed but
+    not profiled.
+    '''
+
+    def __init__(self):
+        super(StageTimings, self).__init__()
+        self.enabled = False
+        self.profile_dir = None
+        self.stages = OrderedDict()
+        self._active = 0
+
+    def enable(self, profile_dir=None):
+        self.enabled = True
+        self.profile_dir = profile_dir
+
+    def get(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(name)
+        return stats
+
+    def add(self, name, wall):
+        '''Record wall time measured elsewhere, e.g. a download, that has no CPU time of ours.'''
+        stats = self.get(name)
+        stats.calls += 1
+        stats.wall += wall
+
+    @contextmanager
+    def _timed(self, name):
+        stats = self.get(name)
+        profile = None
+        if self.profile_dir and self._active == 0:
+            profile = stats.profile
+            if profile is None:
+                profile = stats.profile = cProfile.Profile()
+        self._active += 1
+        wall = time.time()
+        cpu = time.clock()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            stats.calls += 1
+            stats.cpu = (stats.cpu or 0.0) + time.clock() - cpu
+            stats.wall += time.time() - wall
+            self._active -= 1
+
+    def stage(self, name):
+        if not self.enabled:
+            return _null_stage
+        return self._timed(name)
+
+    def report(self, total_wall=None, total_cpu=None):
+        lines = ["{0:<16} {1:>8} {2:>10} {3:>10}".format("Stage", "Calls", "Wall s", "CPU s")]
+        for stats in self.stages.itervalues():
+            cpu = "-" if stats.cpu is None else "{0:.3f}".format(stats.cpu)
+            lines.append("{0:<16} {1:>8} {2:>10.3f} {3:>10}".format(stats.name, stats.calls, stats.wall, cpu))
+        if total_wall is not None:
+            lines.append("{0:<16} {1:>8} {2:>10.3f} {3:>10.3f}".format("total", "", total_wall, total_cpu))
+        if "download" in self.stages:
+            lines.append("(download wall time is the sum over concurrent requests)")
+        return os.linesep.join(lines)
+
+    def save_profiles(self):
+        '''Dump each stage's profile, return the paths written.'''
+        if not self.profile_dir:
+            return []
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        paths = []
+        for stats in self.stages.itervalues():
+            if stats.profile is None:
+                continue
+            path = os.path.join(self.profile_dir, "{0}.pstats".format(stats.name))
+            stats.profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_stage = _NullStage()
+
+stage_timings = StageTimings()